@@ -1,24 +1,242 @@
 import discord
 import datetime
+import functools
+import gzip
+import hashlib
 import json
+import math
 import os
 import aiohttp
 import asyncio
 import config
+import cProfile
+import io
+import ipaddress
+import marshal
+import pstats
 import random
 import re
-import requests
+import resource
+import ssl
+import struct
+import subprocess
+import sys
+import threading
+import tracemalloc
+import time
 import certifi
 import yt_dlp as youtube_dl
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urlsplit
 from discord import Webhook
 from discord.ext import commands
 
+# Pillow is only needed for attachment scanning
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # Initialize bot with intents
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix=config.PREFIX, intents=intents)
+# Cache for static embeds (help, info), keyed by name
+embed_cache = {}
+
+# Drop every cached embed so it gets rebuilt on next use
+def invalidate_embed_cache():
+    embed_cache.clear()
+
+# Shard automatically when asked to, or when launcher.py hands this process a shard range
+BotBase = commands.AutoShardedBot if config.AUTO_SHARD or config.SHARD_IDS else commands.Bot
+
+# Give each launcher worker its own copy of a local file or directory, keyed by its shard range
+def worker_path(path):
+    if not config.SHARD_IDS:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-shards-{config.SHARD_IDS[0]}-{config.SHARD_IDS[-1]}{ext}"
+
+# Bot that invalidates cached help embeds whenever commands change
+class SaturnBot(BotBase):
+    def add_command(self, command):
+        super().add_command(command)
+        invalidate_embed_cache()
+
+    def remove_command(self, name):
+        command = super().remove_command(name)
+        invalidate_embed_cache()
+        return command
+
+    async def setup_hook(self):
+        dm_dispatcher.start()
+        guild_config.start_watching()
+        if config.COORDINATOR_ENABLED:
+            coordinator.start(config.COORDINATOR_HOST, config.COORDINATOR_PORT)
+        if event_recorder:
+            event_recorder.start()
+        if link_scanner:
+            await link_scanner.start()
+
+    async def close(self):
+        if event_recorder:
+            await event_recorder.stop()
+        if link_scanner:
+            await link_scanner.close()
+        if audio_cache:
+            audio_cache.save_index()  # Keep play recency that wasn't saved with a download
+        await super().close()
+
+# Resolve the command prefix for the guild a message was sent in
+def get_prefix(bot, message):
+    if message.guild is None:
+        return config.PREFIX
+    return guild_config.get(message.guild.id, "prefix")
+
+# Cache profiles trading memory for how much guild state stays resident
+CACHE_PROFILES = {
+    # Every member and the last 1000 messages, all guilds chunked on startup (discord.py defaults)
+    "full": {
+        "member_cache_flags": discord.MemberCacheFlags.all,
+        "max_messages": 1000,
+        "chunk_guilds_at_startup": True,
+    },
+    # Members in voice or seen joining, a small message cache, guilds chunked on demand
+    "balanced": {
+        "member_cache_flags": lambda: discord.MemberCacheFlags(voice=True, joined=True),
+        "max_messages": 100,
+        "chunk_guilds_at_startup": False,
+    },
+    # Only members in voice, no message cache, guilds chunked on demand
+    "lean": {
+        "member_cache_flags": lambda: discord.MemberCacheFlags(voice=True, joined=False),
+        "max_messages": None,
+        "chunk_guilds_at_startup": False,
+    },
+}
+cache_profile = CACHE_PROFILES[config.CACHE_PROFILE]
+
+bot_options = {
+    "member_cache_flags": cache_profile["member_cache_flags"](),
+    "max_messages": cache_profile["max_messages"],
+    "chunk_guilds_at_startup": cache_profile["chunk_guilds_at_startup"],
+    # Raw socket events are only needed by the event recorder
+    "enable_debug_events": config.RECORD_EVENTS,
+}
+if config.SHARD_IDS:
+    bot_options["shard_ids"] = config.SHARD_IDS
+    bot_options["shard_count"] = config.SHARD_COUNT
+
+bot = SaturnBot(command_prefix=get_prefix, intents=intents, **bot_options)
+
+# Record kinds in event recordings
+RECORD_GATEWAY = 1
+RECORD_COMMAND = 2
+
+# Each record is a header (kind, unix timestamp, payload length) followed by the payload
+RECORD_HEADER = struct.Struct("<BdI")
+
+# Seconds between flushes of recorded events to disk
+RECORD_FLUSH_INTERVAL = 1
+
+# Records held in memory before new ones are dropped, in case the disk falls behind
+RECORD_MAX_PENDING = 100000
+
+# Writes gateway events and command invocations to rotating gzip files
+# Handlers only append to a deque; compression and disk writes happen in a thread
+class EventRecorder:
+    def __init__(self, directory, max_file_bytes, max_files):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.pending = deque()
+        self.dropped = 0
+        self.file = None
+        self.file_bytes = 0
+        self.file_count = 0
+        self.file_lock = threading.Lock()  # A cancelled flush may still be writing in its thread
+        self.writer = None
+
+    def record(self, kind, payload):
+        if len(self.pending) >= RECORD_MAX_PENDING:
+            self.dropped += 1
+            return
+        self.pending.append((kind, time.time(), payload))
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.writer is None:
+            self.writer = asyncio.create_task(self.write_loop())
+
+    async def stop(self):
+        if self.writer:
+            self.writer.cancel()
+            self.writer = None
+        await self.flush()
+        with self.file_lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    async def write_loop(self):
+        while True:
+            await asyncio.sleep(RECORD_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        if batch:
+            await asyncio.get_running_loop().run_in_executor(None, self.write_batch, batch)
+
+    def write_batch(self, batch):
+        with self.file_lock:
+            for kind, timestamp, payload in batch:
+                if self.file is None or self.file_bytes >= self.max_file_bytes:
+                    self.rotate()
+                self.file.write(RECORD_HEADER.pack(kind, timestamp, len(payload)))
+                self.file.write(payload)
+                self.file_bytes += RECORD_HEADER.size + len(payload)
+            self.file.flush()
+
+    # Start a new file and delete the oldest ones past the limit
+    def rotate(self):
+        if self.file:
+            self.file.close()
+        self.file_count += 1
+        path = os.path.join(self.directory, f"events-{int(time.time() * 1000)}-{self.file_count:06d}.bin.gz")
+        self.file = gzip.open(path, 'wb', compresslevel=1)
+        self.file_bytes = 0
+
+        recordings = sorted(name for name in os.listdir(self.directory) if name.endswith('.bin.gz'))
+        for name in recordings[:-self.max_files]:
+            os.remove(os.path.join(self.directory, name))
+
+# Read (kind, timestamp, payload) records from recording files in order
+def read_recording(paths):
+    for path in sorted(paths):
+        with gzip.open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break  # End of file, or a record cut off by a crash
+                kind, timestamp, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    break
+                yield kind, timestamp, payload
+
+event_recorder = EventRecorder(
+    worker_path(config.RECORD_DIR),
+    config.RECORD_MAX_FILE_BYTES,
+    config.RECORD_MAX_FILES
+) if config.RECORD_EVENTS else None
 
 # FFmpeg options
 FFMPEG_OPTIONS = {
@@ -40,9 +258,204 @@ async def get_audio_source(url):
             info = info['entries'][0]
         return {
             'source': info['url'],
-            'title': info['title']
+            'title': info['title'],
+            'id': info.get('id'),
+            'webpage_url': info.get('webpage_url', url)
         }
 
+# Names of files the audio cache downloads (see outtmpl below), including partial downloads
+AUDIO_CACHE_FILE_PATTERN = re.compile(r"^[\w-]+\.(webm|m4a|mp4|opus|ogg|mp3|aac)(\.part|\.ytdl)?$")
+
+# Byte-capped LRU cache of downloaded tracks, indexed by video ID
+class AudioCache:
+    def __init__(self, directory, max_bytes, max_downloads):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self.entries = OrderedDict()  # video_id -> {"file": name, "size": bytes}, oldest first
+        self.downloading = {}
+        self.download_slots = asyncio.Semaphore(max_downloads)
+        self.load_index()
+
+    @property
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    # Load the index from disk, dropping missing files and leftover downloads not in the index
+    def load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                for video_id, entry in json.load(f):
+                    if os.path.exists(os.path.join(self.directory, entry['file'])):
+                        self.entries[video_id] = entry
+
+        known_files = {entry['file'] for entry in self.entries.values()}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name not in known_files and AUDIO_CACHE_FILE_PATTERN.match(name) and os.path.isfile(path):
+                os.remove(path)
+        self.evict()
+
+    def save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, self.index_path)
+
+    # Return the local file for a track and mark it recently used, or None if not cached
+    # Recency is only tracked in memory here, the index is saved when downloads change it
+    def path_for(self, video_id):
+        entry = self.entries.get(video_id)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry['file'])
+        if not os.path.exists(path):
+            del self.entries[video_id]
+            return None
+        self.entries.move_to_end(video_id)
+        return path
+
+    # Start downloading a track in the background if it isn't cached yet
+    def prefetch(self, song):
+        video_id = song.get('id')
+        if not video_id or video_id in self.entries or video_id in self.downloading:
+            return
+        task = asyncio.create_task(self.download(video_id, song['webpage_url']))
+        self.downloading[video_id] = task
+        task.add_done_callback(lambda _: self.downloading.pop(video_id, None))
+
+    async def download(self, video_id, url):
+        async with self.download_slots:
+            try:
+                path = await asyncio.get_running_loop().run_in_executor(None, self.download_blocking, url)
+            except Exception as e:
+                print(f"Failed to cache track {video_id}: {e}")
+                return
+        self.entries[video_id] = {'file': os.path.basename(path), 'size': os.path.getsize(path)}
+        self.evict()
+        self.save_index()
+
+    def download_blocking(self, url):
+        options = dict(
+            YTDL_OPTIONS,
+            outtmpl=os.path.join(self.directory, '%(id)s.%(ext)s'),
+            quiet=True
+        )
+        with youtube_dl.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=True)
+            if 'entries' in info:
+                info = info['entries'][0]
+            return ydl.prepare_filename(info)
+
+    # Remove least recently used tracks until the cache fits its byte cap
+    def evict(self):
+        total = self.total_bytes
+        while total > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            total -= entry['size']
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+
+audio_cache = AudioCache(
+    worker_path(config.AUDIO_CACHE_DIR),
+    config.AUDIO_CACHE_MAX_BYTES,
+    config.AUDIO_CACHE_DOWNLOADS
+) if config.AUDIO_CACHE_ENABLED else None
+
+# Measure a track's integrated loudness (LUFS) with FFmpeg's ebur128 filter
+# Runs inside a worker process, so it must stay a plain top-level function
+def measure_loudness(source):
+    result = subprocess.run(
+        ['ffmpeg', '-nostats', '-hide_banner', '-i', source, '-vn', '-af', 'ebur128', '-f', 'null', '-'],
+        capture_output=True,
+        text=True,
+        timeout=600
+    )
+    matches = re.findall(r'I:\s+(-?[\d.]+) LUFS', result.stderr)
+    if not matches:
+        raise RuntimeError("FFmpeg did not report integrated loudness")
+    return float(matches[-1])  # The last match is the summary for the whole track
+
+# Per-track gain values, measured once in a process pool and persisted by video ID
+class LoudnessCache:
+    def __init__(self, path, target, workers):
+        self.path = path
+        self.target = target
+        self.workers = workers
+        self.executor = None
+        self.analyzing = {}
+        self.gains = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.gains = json.load(f)
+
+    # Merge with what's on disk first, since launcher workers share the file
+    def save(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.gains = {**json.load(f), **self.gains}
+            except ValueError:
+                pass  # Unreadable file, overwrite it with ours
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.gains, f)
+        os.replace(tmp_path, self.path)
+
+    def gain_for(self, video_id):
+        return self.gains.get(video_id)
+
+    # Start measuring a track in the background if its gain isn't known yet
+    def analyze(self, song):
+        video_id = song.get('id')
+        if not video_id or video_id in self.gains or video_id in self.analyzing:
+            return
+        task = asyncio.create_task(self.measure(video_id, song))
+        self.analyzing[video_id] = task
+        task.add_done_callback(lambda _: self.analyzing.pop(video_id, None))
+
+    async def measure(self, video_id, song):
+        # Prefer the cached file so the track isn't fetched twice
+        if audio_cache:
+            download = audio_cache.downloading.get(video_id)
+            if download:
+                await download
+            source = audio_cache.path_for(video_id) or song['source']
+        else:
+            source = song['source']
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            loudness = await asyncio.get_running_loop().run_in_executor(self.executor, measure_loudness, source)
+        except Exception as e:
+            print(f"Failed to measure loudness for {video_id}: {e}")
+            return
+
+        # Limit boosts so quiet tracks don't get pushed into clipping
+        gain = max(-20.0, min(self.target - loudness, 10.0))
+        self.gains[video_id] = round(gain, 2)
+        self.save()
+
+    # FFmpeg options with a fixed volume adjustment for the track, if one is known
+    def ffmpeg_options(self, video_id):
+        gain = self.gain_for(video_id)
+        if gain is None:
+            return FFMPEG_OPTIONS
+        return dict(FFMPEG_OPTIONS, options=f"{FFMPEG_OPTIONS['options']} -af volume={gain}dB")
+
+loudness_cache = LoudnessCache(
+    config.LOUDNESS_CACHE_FILE,
+    config.LOUDNESS_TARGET,
+    config.LOUDNESS_WORKERS
+) if config.LOUDNESS_NORMALIZATION else None
+
+# Songs waiting to be played
+queue = []
+
 # Database to store warnings
 warnings_db = {}
 
@@ -56,15 +469,258 @@ def save_warnings():
     with open('warnings.json', 'w') as f:
         json.dump(warnings_db, f)
 
+# Re-read warnings written by the coordinator, e.g. after missing its updates while disconnected
+def reload_warnings():
+    if os.path.exists('warnings.json'):
+        with open('warnings.json', 'r') as f:
+            data = json.load(f)
+        warnings_db.clear()
+        warnings_db.update(data)
+
+# Append-only moderation case log with in-memory indexes
+# Cases and later reason edits are separate JSON lines, so edits never rewrite the file
+class CaseLog:
+    def __init__(self, path):
+        self.path = path
+        self.cases = {}         # case_id -> case
+        self.last_id = 0
+        self.by_user = {}       # (guild_id, user_id) -> [case_id, ...] oldest first
+        self.by_moderator = {}  # (guild_id, moderator_id) -> [case_id, ...]
+        self.by_action = {}     # (guild_id, action) -> [case_id, ...]
+        self.offset = 0         # Bytes of the file already applied
+        self.catch_up()
+
+    # Apply records appended to the file since the last read, e.g. by the coordinator
+    def catch_up(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # Leave a half-written last line for next time
+        for line in data[:end].splitlines():
+            if line.strip():
+                self.apply(json.loads(line))
+        self.offset += end
+
+    # Apply one log record to the in-memory state
+    def apply(self, record):
+        if record["type"] == "case":
+            if record["id"] in self.cases:
+                return  # Already applied, e.g. our own case echoed by the coordinator
+            case = {key: value for key, value in record.items() if key != "type"}
+            self.cases[case["id"]] = case
+            self.last_id = max(self.last_id, case["id"])
+            guild_id = case["guild_id"]
+            self.by_user.setdefault((guild_id, case["user_id"]), []).append(case["id"])
+            self.by_moderator.setdefault((guild_id, case["moderator_id"]), []).append(case["id"])
+            self.by_action.setdefault((guild_id, case["action"]), []).append(case["id"])
+        elif record["type"] == "reason":
+            case = self.cases.get(record["id"])
+            if case:
+                case["reason"] = record["reason"]
+                case["reason_edited_by"] = record["edited_by"]
+                case["reason_edited_at"] = record["timestamp"]
+
+    def write(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    # Give a new case the next ID, then store and index it
+    def append(self, record):
+        if record["type"] == "case":
+            record["id"] = self.last_id + 1
+        self.write(record)
+        self.apply(record)
+        return record["id"]
+
+    def get(self, case_id):
+        return self.cases.get(case_id)
+
+    def for_user(self, guild_id, user_id):
+        return [self.cases[case_id] for case_id in self.by_user.get((guild_id, user_id), [])]
+
+    def for_moderator(self, guild_id, moderator_id):
+        return [self.cases[case_id] for case_id in self.by_moderator.get((guild_id, moderator_id), [])]
+
+    def for_action(self, guild_id, action):
+        return [self.cases[case_id] for case_id in self.by_action.get((guild_id, action), [])]
+
+    # Short summary of a user's cases, e.g. "3 (2 warn, 1 timeout)", or None if there are none
+    def summary(self, guild_id, user_id):
+        cases = self.for_user(guild_id, user_id)
+        if not cases:
+            return None
+        counts = {}
+        for case in cases:
+            counts[case["action"]] = counts.get(case["action"], 0) + 1
+        return f"{len(cases)} (" + ", ".join(f"{count} {action}" for action, count in counts.items()) + ")"
+
+case_log = CaseLog(config.CASES_FILE)
+
+# Write a log record, through the coordinator when running as a launcher worker so IDs stay unique
+async def write_case_record(record):
+    if config.COORDINATOR_ENABLED:
+        return await coordinator.request("case", record=record)
+    return case_log.append(record)
+
+# Open a moderation case and return its ID
+async def record_case(guild, action, user, moderator, reason, **details):
+    return await write_case_record({
+        "type": "case",
+        "guild_id": guild.id,
+        "action": action,
+        "user_id": user.id,
+        "moderator_id": moderator.id,
+        "reason": reason,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "details": details,
+    })
+
+# Replace a case's reason by appending an edit record
+async def edit_case_reason(case_id, reason, editor):
+    await write_case_record({
+        "type": "reason",
+        "id": case_id,
+        "reason": reason,
+        "edited_by": editor.id,
+        "timestamp": datetime.datetime.now().isoformat(),
+    })
+
+# Persist a warning change, through the coordinator when running as a launcher worker
+# Changes made while it is unreachable are held and sent once it reconnects
+async def sync_warnings(user_id, action, warning=None):
+    if config.COORDINATOR_ENABLED:
+        await coordinator.send_or_queue({"op": "warnings", "action": action, "user_id": str(user_id), "warning": warning})
+    else:
+        save_warnings()
+
 # 8ball responses
 EIGHTBALL_RESPONSES = [
     "Yes.", "No.", "Maybe.", "Ask again later.", "Definitely!", 
     "I don't think so.", "Absolutely!", "Very doubtful."
 ]
 
+# Per-guild settings, falling back to the global values in config.py
+GUILD_CONFIG_DEFAULTS = {
+    "prefix": lambda: config.PREFIX,
+    "modlog_channel_id": lambda: config.MODLOG_CHANNEL_ID,
+    "max_warnings": lambda: config.MAX_WARNINGS,
+    "auto_timeout_duration": lambda: config.AUTO_TIMEOUT_DURATION,
+    "mod_role_ids": lambda: [],
+}
+
+# Parsers for values given to ?config set
+GUILD_CONFIG_PARSERS = {
+    "prefix": str,
+    "modlog_channel_id": int,
+    "max_warnings": int,
+    "auto_timeout_duration": int,
+    "mod_role_ids": lambda value: [int(role_id.strip('<@&>')) for role_id in value.replace(",", " ").split()],
+}
+
+# Per-guild config stored in a JSON file and reloaded whenever the file changes
+class GuildConfigStore:
+    def __init__(self, path, reload_interval):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.settings = {}  # guild_id (str) -> {key: value}
+        self.mtime = None
+        self.watcher = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            self.settings = {}
+            self.mtime = None
+            return
+        self.mtime = os.path.getmtime(self.path)
+        with open(self.path, 'r') as f:
+            self.settings = json.load(f)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.settings, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.mtime = os.path.getmtime(self.path)
+
+    def get(self, guild_id, key):
+        value = self.settings.get(str(guild_id), {}).get(key)
+        return GUILD_CONFIG_DEFAULTS[key]() if value is None else value
+
+    def set(self, guild_id, key, value):
+        # Pick up edits made by other processes before writing
+        self.reload_if_changed()
+        self.settings.setdefault(str(guild_id), {})[key] = value
+        self.save()
+        self.on_change(guild_id)
+
+    def reset(self, guild_id, key):
+        self.reload_if_changed()
+        self.settings.get(str(guild_id), {}).pop(key, None)
+        self.save()
+        self.on_change(guild_id)
+
+    def reload_if_changed(self):
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self.mtime:
+            return False
+        self.load()
+        self.on_change(None)
+        return True
+
+    # Drop anything derived from the old settings
+    def on_change(self, guild_id):
+        permission_cache.invalidate(guild_id)
+        invalidate_embed_cache()
+
+    def start_watching(self):
+        if self.watcher is None:
+            self.watcher = asyncio.create_task(self.watch())
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                if self.reload_if_changed():
+                    print("Reloaded guild config.")
+            except (OSError, ValueError) as e:
+                print(f"Failed to reload guild config: {e}")
+
+# Cached moderator permission per (guild, member), cleared on role and member updates
+# Roles are checked on every call, since member role updates aren't delivered for uncached members
+class PermissionCache:
+    def __init__(self):
+        self.admin_ids = set(config.ADMIN_IDS)
+        self.guilds = {}  # guild_id -> frozenset of moderator role ids
+
+    def is_moderator(self, member):
+        if member.id in self.admin_ids:
+            return True
+        guild = getattr(member, "guild", None)
+        if guild is None:
+            return False
+
+        mod_role_ids = self.guilds.get(guild.id)
+        if mod_role_ids is None:
+            mod_role_ids = frozenset(guild_config.get(guild.id, "mod_role_ids"))
+            self.guilds[guild.id] = mod_role_ids
+        return any(role.id in mod_role_ids for role in member.roles)
+
+    def invalidate(self, guild_id=None):
+        if guild_id is None:
+            self.admin_ids = set(config.ADMIN_IDS)
+            self.guilds.clear()
+        else:
+            self.guilds.pop(guild_id, None)
+
+permission_cache = PermissionCache()
+guild_config = GuildConfigStore(config.GUILD_CONFIG_FILE, config.GUILD_CONFIG_RELOAD_INTERVAL)
+
 # Check if a user is an admin
 def is_admin(ctx):
-    return ctx.author.id in config.ADMIN_IDS
+    return permission_cache.is_moderator(ctx.author)
 
 # Admin check decorator
 def admin_only():
@@ -75,9 +731,214 @@ def admin_only():
         return True
     return commands.check(predicate)
 
+# Check for config.ADMIN_IDS or the guild's administrators, for settings moderators mustn't change
+def server_admin_only():
+    async def predicate(ctx):
+        permissions = getattr(ctx.author, "guild_permissions", None)
+        if ctx.author.id not in permission_cache.admin_ids and not (permissions and permissions.administrator):
+            await ctx.send("Only server administrators can use this command.")
+            return False
+        return True
+    return commands.check(predicate)
+
+# Check for config.ADMIN_IDS only, for commands that affect every guild
+def bot_admin_only():
+    async def predicate(ctx):
+        if ctx.author.id not in permission_cache.admin_ids:
+            await ctx.send("Only the bot's administrators can use this command.")
+            return False
+        return True
+    return commands.check(predicate)
+
+# Seconds between sweeps of idle cooldown buckets
+LIMITER_SWEEP_INTERVAL = 300
+
+# How a limit's key is picked from the command context
+LIMIT_SCOPES = {
+    "guild": lambda ctx: ctx.guild.id if ctx.guild else None,
+    "channel": lambda ctx: ctx.channel.id,
+    "user": lambda ctx: ctx.author.id,
+}
+
+# Raised when a command's wait queue is already full
+class CommandQueueFull(Exception):
+    pass
+
+# Running and waiting invocations for one concurrency key
+class ConcurrencySlot:
+    __slots__ = ("active", "waiters")
+
+    def __init__(self):
+        self.active = 0
+        self.waiters = deque()  # (future, on_queued) in queue order
+
+# Concurrency caps and token-bucket cooldowns, keyed by (command, scope, id)
+# Entries only exist while they hold state, so idle keys cost nothing
+class CommandLimiter:
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.slots = {}    # key -> ConcurrencySlot
+        self.buckets = {}  # key -> (tokens, updated, full_at)
+        self.last_sweep = time.monotonic()
+
+    # Take a token from the bucket, returning 0 or the seconds until one is available
+    def take_token(self, key, rate, per):
+        now = time.monotonic()
+        self.sweep(now)
+        tokens, updated, _ = self.buckets.get(key, (rate, now, now))
+        tokens = min(rate, tokens + (now - updated) * rate / per)
+        if tokens < 1:
+            retry_after = (1 - tokens) * per / rate
+        else:
+            tokens -= 1
+            retry_after = 0
+        self.buckets[key] = (tokens, now, now + (rate - tokens) * per / rate)
+        return retry_after
+
+    # Give back a token taken for a run that never happened
+    def refund_token(self, key, rate, per):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return  # Already full
+        tokens, updated, _ = bucket
+        tokens = min(rate, tokens + 1)
+        self.buckets[key] = (tokens, updated, updated + (rate - tokens) * per / rate)
+
+    # Drop buckets that have refilled, since a missing bucket is a full one
+    def sweep(self, now):
+        if now - self.last_sweep < LIMITER_SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        for key in [key for key, bucket in self.buckets.items() if bucket[2] <= now]:
+            del self.buckets[key]
+
+    # Wait for a free slot, calling on_queued with the queue position when we join and as it moves
+    async def acquire(self, key, limit, on_queued):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = ConcurrencySlot()
+        if slot.active < limit and not slot.waiters:
+            slot.active += 1
+            return
+
+        if len(slot.waiters) >= self.max_queue:
+            raise CommandQueueFull()
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, on_queued)
+        slot.waiters.append(entry)
+        try:
+            await on_queued(len(slot.waiters))
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release(key)  # We were handed the slot but won't use it
+            else:
+                waiter.cancel()
+                if entry in slot.waiters:
+                    slot.waiters.remove(entry)
+                    self.report_positions(slot)
+                self.discard_if_idle(key)
+            raise
+
+    # Hand the slot to the next waiter, or free it
+    def release(self, key):
+        slot = self.slots[key]
+        while slot.waiters:
+            waiter, _ = slot.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.report_positions(slot)
+                return
+        slot.active -= 1
+        self.discard_if_idle(key)
+
+    # Tell everyone still waiting their new place in the queue
+    def report_positions(self, slot):
+        for position, (waiter, on_queued) in enumerate(slot.waiters, 1):
+            if not waiter.done():
+                asyncio.create_task(on_queued(position))
+
+    def discard_if_idle(self, key):
+        slot = self.slots.get(key)
+        if slot is not None and slot.active == 0 and not slot.waiters:
+            del self.slots[key]
+
+command_limiter = CommandLimiter(config.LIMITER_MAX_QUEUE)
+
+# Declarative limits for a command, e.g. @limited(guild=1, user=1, cooldown=("user", 1, 60))
+# guild/channel/user cap concurrent runs per scope; extra invocations queue up.
+# cooldown is (scope, rate, per): at most `rate` runs per `per` seconds per scope.
+def limited(guild=None, channel=None, user=None, cooldown=None):
+    caps = [(scope, cap) for scope, cap in (("guild", guild), ("channel", channel), ("user", user)) if cap]
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(ctx, *args, **kwargs):
+            name = ctx.command.qualified_name
+
+            if cooldown:
+                scope, rate, per = cooldown
+                bucket_key = (name, scope, LIMIT_SCOPES[scope](ctx))
+                retry_after = command_limiter.take_token(bucket_key, rate, per)
+                if retry_after:
+                    await ctx.send(f"⏳ `{ctx.prefix}{name}` is on cooldown. Try again in {math.ceil(retry_after)}s.")
+                    return
+
+            queued_message = None
+            shown_position = None
+            wanted_position = None
+            updating = False
+            started = False
+
+            # Show or update the queue position, one edit at a time so updates land in order
+            async def on_queued(position):
+                nonlocal queued_message, shown_position, wanted_position, updating
+                wanted_position = position
+                if updating:
+                    return  # The running update picks up the new position
+                updating = True
+                try:
+                    while shown_position != wanted_position and not started:
+                        target = wanted_position
+                        text = f"⏳ `{ctx.prefix}{name}` is busy. You're #{target} in the queue."
+                        if queued_message:
+                            await queued_message.edit(content=text)
+                        else:
+                            queued_message = await ctx.send(text)
+                        shown_position = target
+                except discord.HTTPException:
+                    pass
+                finally:
+                    updating = False
+
+            acquired = []
+            try:
+                for scope, cap in caps:
+                    key = (name, scope, LIMIT_SCOPES[scope](ctx))
+                    await command_limiter.acquire(key, cap, on_queued)
+                    acquired.append(key)
+
+                started = True
+                if queued_message:
+                    try:
+                        await queued_message.delete()
+                    except discord.HTTPException:
+                        pass
+                return await func(ctx, *args, **kwargs)
+            except CommandQueueFull:
+                if cooldown:
+                    command_limiter.refund_token(bucket_key, rate, per)  # The command never ran
+                await ctx.send(f"`{ctx.prefix}{name}` is too busy right now. Try again later.")
+            finally:
+                for key in reversed(acquired):
+                    command_limiter.release(key)
+        return wrapper
+    return decorator
+
 # Send a message to the modlog channel
-async def send_to_modlog(guild, title, description, color=discord.Color.blue()):
-    modlog_channel = bot.get_channel(config.MODLOG_CHANNEL_ID)
+async def send_to_modlog(guild, title, description, color=discord.Color.blue(), case_id=None):
+    modlog_channel_id = guild_config.get(guild.id, "modlog_channel_id")
+    modlog_channel = bot.get_channel(modlog_channel_id)
     if modlog_channel:
         embed = discord.Embed(
             title=title,
@@ -85,29 +946,1128 @@ async def send_to_modlog(guild, title, description, color=discord.Color.blue()):
             color=color,
             timestamp=datetime.datetime.now()
         )
+        if case_id is not None:
+            embed.set_footer(text=f"Case #{case_id}")
         await modlog_channel.send(embed=embed)
+    elif coordinator.connected:
+        # The modlog channel lives on another worker's shard, let that worker post it
+        await coordinator.send({
+            "op": "broadcast",
+            "payload": {
+                "op": "modlog",
+                "channel_id": modlog_channel_id,
+                "title": title,
+                "description": description,
+                "color": color.value,
+                "case_id": case_id
+            }
+        })
+
+# Raised when a write needs the coordinator and it stays unreachable
+class CoordinatorUnavailable(Exception):
+    pass
+
+# Seconds between coordinator reconnect attempts, doubling up to the maximum
+COORDINATOR_RETRY_MIN = 1
+COORDINATOR_RETRY_MAX = 30
+
+# Client for the launcher.py coordinator, speaking newline-delimited JSON
+class CoordinatorClient:
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.runner = None
+        self.ready = asyncio.Event()  # Set while connected and introduced
+        self.outbox = deque()         # Messages waiting for a connection
+        self.handlers = {}
+        self.pending = {}
+        self.next_id = 0
+
+    @property
+    def connected(self):
+        return self.ready.is_set() and not self.writer.is_closing()
+
+    def start(self, host, port):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self.run(host, port))
+
+    # Stay connected, reconnecting with backoff whenever the connection drops
+    async def run(self, host, port):
+        delay = COORDINATOR_RETRY_MIN
+        while True:
+            try:
+                await self.connect(host, port)
+                delay = COORDINATOR_RETRY_MIN
+                await self.listen()
+                print("Lost connection to the coordinator.")
+            except OSError as e:
+                print(f"Couldn't reach the coordinator: {e}")
+            self.disconnected()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, COORDINATOR_RETRY_MAX)
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        await self.send({"op": "hello", "pid": os.getpid(), "shard_ids": config.SHARD_IDS})
+        while self.outbox:
+            await self.send(self.outbox[0])
+            self.outbox.popleft()
+        # Pick up whatever other workers wrote while we weren't listening
+        reload_warnings()
+        case_log.catch_up()
+        if image_scanner:
+            image_scanner.load()
+        self.ready.set()
+
+    def disconnected(self):
+        self.ready.clear()
+        if self.writer:
+            self.writer.close()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(CoordinatorUnavailable("Lost connection to the coordinator"))
+
+    # Register a coroutine that handles messages with the given op
+    def handler(self, op):
+        def decorator(func):
+            self.handlers[op] = func
+            return func
+        return decorator
+
+    async def send(self, payload):
+        self.writer.write(json.dumps(payload).encode() + b"\n")
+        await self.writer.drain()
+
+    # Send a message that doesn't need a reply, holding it until reconnected if necessary
+    async def send_or_queue(self, payload):
+        if self.connected:
+            try:
+                await self.send(payload)
+                return
+            except OSError:
+                pass  # The runner notices the drop and reconnects
+        self.outbox.append(payload)
+
+    # Send a request and wait for the coordinator's reply, waiting up to timeout for a connection
+    async def request(self, op, timeout=10, **data):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise CoordinatorUnavailable("The coordinator is unreachable")
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            try:
+                await self.send({"op": op, "id": request_id, **data})
+            except OSError:
+                raise CoordinatorUnavailable("Lost connection to the coordinator")
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if "reply_to" in message:
+                future = self.pending.get(message["reply_to"])
+                if future and not future.done():
+                    future.set_result(message.get("result"))
+                continue
+            handler = self.handlers.get(message.get("op"))
+            if handler is None:
+                continue
+            try:
+                result = await handler(message)
+            except Exception as e:
+                print(f"Coordinator handler {message.get('op')} failed: {e}")
+                result = None
+            if "id" in message:
+                await self.send({"reply_to": message["id"], "result": result})
+
+coordinator = CoordinatorClient()
+
+# Post modlog entries forwarded from other workers if the channel is ours
+@coordinator.handler("modlog")
+async def handle_forwarded_modlog(message):
+    modlog_channel = bot.get_channel(message["channel_id"])
+    if modlog_channel:
+        embed = discord.Embed(
+            title=message["title"],
+            description=message["description"],
+            color=discord.Color(message["color"]),
+            timestamp=datetime.datetime.now()
+        )
+        if message.get("case_id") is not None:
+            embed.set_footer(text=f"Case #{message['case_id']}")
+        await modlog_channel.send(embed=embed)
+
+# Add an image hash blocked on another worker
+@coordinator.handler("image_block")
+async def handle_image_block(message):
+    if image_scanner:
+        image_scanner.tree.add(message["hash"])
+
+# Apply cases and reason edits assigned by the coordinator
+@coordinator.handler("case_sync")
+async def handle_case_sync(message):
+    case_log.apply(message["record"])
+
+# Apply the coordinator's authoritative warning list for a user
+@coordinator.handler("warnings_sync")
+async def handle_warnings_sync(message):
+    if message["warnings"]:
+        warnings_db[message["user_id"]] = message["warnings"]
+    else:
+        warnings_db.pop(message["user_id"], None)
+
+# Report this worker's shards for cross-shard status commands
+@coordinator.handler("shard_status")
+async def handle_shard_status(message):
+    return local_shard_status()
+
+# Describe the shards running in this process
+def local_shard_status():
+    if isinstance(bot, commands.AutoShardedBot):
+        shards = [
+            {"id": shard_id, "latency": round(latency * 1000)}
+            for shard_id, latency in bot.latencies
+        ]
+    else:
+        shards = [{"id": 0, "latency": round(bot.latency * 1000)}]
+    return {"pid": os.getpid(), "guilds": len(bot.guilds), "shards": shards}
+
+# Return a cached embed, building it with the async builder on first use
+async def get_cached_embed(key, builder):
+    embed = embed_cache.get(key)
+    if embed is None:
+        embed = await builder()
+        embed_cache[key] = embed
+    return embed
+
+# Warnings shown per page (Discord allows at most 25 fields per embed)
+WARNINGS_PER_PAGE = 10
+
+# Resolve a user's display name, preferring the local cache over a REST fetch
+async def resolve_user_name(user_id):
+    if user_id is None:
+        return "Unknown"
+    user = bot.get_user(user_id)
+    if user is None:
+        try:
+            user = await bot.fetch_user(user_id)
+        except discord.NotFound:
+            return "Unknown"
+    return f"{user}"
+
+# Build the embed for one page of a warning list, only resolving that page's warners
+async def render_warnings_page(title, description, warning_list, page):
+    page_count = max(1, -(-len(warning_list) // WARNINGS_PER_PAGE))
+    page = max(0, min(page, page_count - 1))
+    start = page * WARNINGS_PER_PAGE
+
+    embed = discord.Embed(
+        title=title,
+        description=description,
+        color=discord.Color.orange()
+    )
+
+    for i, warning in enumerate(warning_list[start:start + WARNINGS_PER_PAGE], start + 1):
+        warner_name = await resolve_user_name(warning.get("warned_by"))
+
+        embed.add_field(
+            name=f"Warning {i}",
+            value=f"**Reason:** {warning.get('reason', 'No reason provided')}\n"
+                 f"**Warned by:** {warner_name}\n"
+                 f"**Date:** {warning.get('timestamp', 'Unknown')}",
+            inline=False
+        )
+
+    if page_count > 1:
+        embed.set_footer(text=f"Page {page + 1}/{page_count}")
+    return embed
+
+# Button-driven pagination, rendering pages on demand with render_page(page)
+class Paginator(discord.ui.View):
+    def __init__(self, author_id, page_count, render_page):
+        super().__init__(timeout=120)
+        self.author_id = author_id
+        self.render_page = render_page
+        self.page = 0
+        self.page_count = max(1, page_count)
+        self.message = None
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+
+    async def render(self):
+        return await self.render_page(self.page)
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran this command can change pages.", ephemeral=True)
+            return False
+        return True
+
+    async def change_page(self, interaction, delta):
+        self.page = max(0, min(self.page + delta, self.page_count - 1))
+        self.update_buttons()
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    # Grey out the buttons once they stop working
+    async def on_timeout(self):
+        self.previous_page.disabled = True
+        self.next_page.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass  # Message was deleted or we lost access
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.change_page(interaction, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self.change_page(interaction, 1)
+
+# Send paginated embeds, attaching buttons only when there is more than one page
+async def send_paginated(ctx, page_count, render_page):
+    paginator = Paginator(ctx.author.id, page_count, render_page)
+    embed = await paginator.render()
+    if paginator.page_count > 1:
+        paginator.message = await ctx.send(embed=embed, view=paginator)
+    else:
+        await ctx.send(embed=embed)
+
+# Send a warning list a page at a time
+async def send_warnings(ctx, title, description, warning_list):
+    page_count = -(-len(warning_list) // WARNINGS_PER_PAGE)
+    await send_paginated(ctx, page_count, functools.partial(render_warnings_page, title, description, warning_list))
+
+# Number of cases shown per page of ?history
+CASES_PER_PAGE = 10
+
+# Format one case for an embed field
+async def format_case(case):
+    moderator_name = await resolve_user_name(case["moderator_id"])
+    lines = [
+        f"**Action:** {case['action']}",
+        f"**Moderator:** {moderator_name}",
+        f"**Reason:** {case['reason'] or 'No reason provided'}",
+        f"**Date:** {case['timestamp']}",
+    ]
+    for key, value in case.get("details", {}).items():
+        lines.append(f"**{key.replace('_', ' ').capitalize()}:** {value}")
+    if "reason_edited_by" in case:
+        editor_name = await resolve_user_name(case["reason_edited_by"])
+        lines.append(f"**Reason edited by:** {editor_name}")
+    return "\n".join(lines)
+
+# Build the embed for one page of a user's case history, newest first
+async def render_history_page(title, case_list, page):
+    page_count = max(1, -(-len(case_list) // CASES_PER_PAGE))
+    page = max(0, min(page, page_count - 1))
+    start = page * CASES_PER_PAGE
+
+    embed = discord.Embed(title=title, color=discord.Color.orange())
+    for case in case_list[start:start + CASES_PER_PAGE]:
+        embed.add_field(name=f"Case #{case['id']}", value=await format_case(case), inline=False)
+
+    if page_count > 1:
+        embed.set_footer(text=f"Page {page + 1}/{page_count}")
+    return embed
+
+# Name of the role used for voice bans
+VOICE_BAN_ROLE_NAME = "Voice Banned"
+
+# Number of guilds reconciled at the same time on startup
+RECONCILE_CONCURRENCY = 4
+
+# Local view of who is banned, timed out or voice banned, indexed by guild then user
+class ModerationState:
+    def __init__(self):
+        self.banned = {}        # guild_id -> set of user ids
+        self.timed_out = {}     # guild_id -> {user_id: timed_out_until}
+        self.voice_banned = {}  # guild_id -> set of user ids
+        self.reconciled = set() # guild ids with a completed startup scan
+
+    # Any part passed as None keeps its current value
+    def replace_guild(self, guild_id, banned, timed_out, voice_banned):
+        if banned is not None:
+            self.banned[guild_id] = banned
+        if timed_out is not None:
+            self.timed_out[guild_id] = timed_out
+        if voice_banned is not None:
+            self.voice_banned[guild_id] = voice_banned
+        self.reconciled.add(guild_id)
+
+    def is_banned(self, guild_id, user_id):
+        return user_id in self.banned.get(guild_id, ())
+
+    def set_banned(self, guild_id, user_id, banned):
+        users = self.banned.setdefault(guild_id, set())
+        if banned:
+            users.add(user_id)
+        else:
+            users.discard(user_id)
+
+    def timed_out_until(self, guild_id, user_id):
+        timeouts = self.timed_out.get(guild_id, {})
+        until = timeouts.get(user_id)
+        if until is not None and until <= discord.utils.utcnow():
+            del timeouts[user_id]
+            return None
+        return until
+
+    def set_timeout(self, guild_id, user_id, until):
+        timeouts = self.timed_out.setdefault(guild_id, {})
+        if until is not None and until > discord.utils.utcnow():
+            timeouts[user_id] = until
+        else:
+            timeouts.pop(user_id, None)
+
+    def is_voice_banned(self, guild_id, user_id):
+        return user_id in self.voice_banned.get(guild_id, ())
+
+    def set_voice_banned(self, guild_id, user_id, voice_banned):
+        users = self.voice_banned.setdefault(guild_id, set())
+        if voice_banned:
+            users.add(user_id)
+        else:
+            users.discard(user_id)
+
+    def describe(self, guild_id, user_id):
+        status = []
+        if self.is_banned(guild_id, user_id):
+            status.append("Banned")
+        until = self.timed_out_until(guild_id, user_id)
+        if until is not None:
+            status.append(f"Timed out until {discord.utils.format_dt(until)}")
+        if self.is_voice_banned(guild_id, user_id):
+            status.append("Voice banned")
+        return ", ".join(status) if status else None
+
+mod_state = ModerationState()
+reconcile_task = None
+
+# Scan one guild's bans, timeouts and voice ban role into the local state cache
+# members defaults to whether the guild is chunked, since the member scan needs every member cached
+async def reconcile_guild(guild, semaphore, bans=True, members=None):
+    async with semaphore:
+        banned = None  # None keeps whatever the ban events told us
+        if bans:
+            try:
+                banned = {entry.user.id async for entry in guild.bans(limit=None)}
+            except discord.Forbidden:
+                pass
+
+        # Members are only complete once the guild is chunked, otherwise wait for schedule_chunk
+        if members is None:
+            members = guild.chunked
+        timed_out = None
+        voice_banned = None
+        if members:
+            now = discord.utils.utcnow()
+            timed_out = {}
+            for i, member in enumerate(guild.members, 1):
+                if member.timed_out_until and member.timed_out_until > now:
+                    timed_out[member.id] = member.timed_out_until
+                if i % 1000 == 0:
+                    await asyncio.sleep(0)  # Let other tasks run on big guilds
+
+            voice_ban_role = discord.utils.get(guild.roles, name=VOICE_BAN_ROLE_NAME)
+            voice_banned = {member.id for member in voice_ban_role.members} if voice_ban_role else set()
+
+        mod_state.replace_guild(guild.id, banned, timed_out, voice_banned)
+
+# Reconcile every guild concurrently, bounded so REST buckets aren't flooded
+async def reconcile_all_guilds():
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    results = await asyncio.gather(
+        *(reconcile_guild(guild, semaphore) for guild in bot.guilds),
+        return_exceptions=True
+    )
+    for guild, result in zip(bot.guilds, results):
+        if isinstance(result, Exception):
+            print(f"Failed to reconcile moderation state for {guild.name}: {result}")
+    print(f"Reconciled moderation state for {len(mod_state.reconciled)} guild(s).")
+
+# Guild chunk requests in progress, keyed by guild ID
+chunk_tasks = {}
+
+# Guilds already chunked once. guild.chunked can't be used for this: with the lean and balanced
+# profiles members who join or leave voice aren't cached, so it turns False again almost immediately
+chunked_guilds = set()
+
+# Chunk a guild in the background the first time a member lookup needs it
+def schedule_chunk(guild):
+    if guild.chunked:
+        chunked_guilds.add(guild.id)
+    if guild.id in chunked_guilds or guild.id in chunk_tasks:
+        return
+    task = asyncio.create_task(chunk_guild(guild))
+    chunk_tasks[guild.id] = task
+    task.add_done_callback(lambda _: chunk_tasks.pop(guild.id, None))
+
+async def chunk_guild(guild):
+    try:
+        await guild.chunk(cache=True)
+    except (asyncio.TimeoutError, discord.HTTPException) as e:
+        print(f"Failed to chunk {guild.name}: {e}")
+        return
+    chunked_guilds.add(guild.id)
+    # Fill in the member-based moderation state skipped on startup, bans are already known
+    await reconcile_guild(guild, asyncio.Semaphore(1), bans=False, members=True)
+
+# In-flight member lookups, keyed by (guild_id, user_id)
+pending_member_lookups = {}
+
+# Look up a member that isn't cached, over the gateway first and REST as a last resort
+async def lookup_member(guild, user_id):
+    try:
+        members = await guild.query_members(user_ids=[user_id], cache=True)
+    except asyncio.TimeoutError:
+        members = []
+    if members:
+        return members[0]
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+
+# Resolve a member from the cache, sharing one lookup between concurrent callers
+async def resolve_member(guild, user_id):
+    schedule_chunk(guild)
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+
+    key = (guild.id, user_id)
+    lookup = pending_member_lookups.get(key)
+    if lookup is None:
+        lookup = asyncio.ensure_future(lookup_member(guild, user_id))
+        pending_member_lookups[key] = lookup
+        lookup.add_done_callback(lambda _: pending_member_lookups.pop(key, None))
+    # Shield so one cancelled command doesn't cancel the lookup for everyone else
+    return await asyncio.shield(lookup)
+
+# Seconds a DM may hold up the action queued after it
+DM_FOLLOW_UP_TIMEOUT = 5
+
+# Background DM delivery so moderation commands never wait on notifications
+class DMDispatcher:
+    def __init__(self, workers, max_queue, closed_ttl):
+        self.worker_count = workers
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed_ttl = closed_ttl
+        self.closed_until = {}  # user_id -> monotonic time to stop skipping them
+        self.workers = []
+        self.stats = {"sent": 0, "closed": 0, "skipped": 0, "dropped": 0, "failed": 0}
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    def has_closed_dms(self, user_id):
+        until = self.closed_until.get(user_id)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            del self.closed_until[user_id]
+            return False
+        return True
+
+    # Queue a DM, skipping users known to have DMs closed and dropping when full
+    # then is an optional coroutine function run once the DM has been tried, for actions
+    # that would stop it arriving (e.g. kicks); it still runs if the DM is skipped or dropped
+    def notify(self, user, message, then=None):
+        if self.has_closed_dms(user.id):
+            self.stats["skipped"] += 1
+            if then:
+                asyncio.create_task(self.run_follow_up(then))
+            return
+        try:
+            self.queue.put_nowait((user, message, then))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            if then:
+                asyncio.create_task(self.run_follow_up(then))
+
+    # Send one DM and record the outcome
+    async def deliver(self, user, message):
+        try:
+            await user.send(message)
+            self.stats["sent"] += 1
+        except discord.Forbidden:
+            # User has DMs closed, remember that for a while
+            self.closed_until[user.id] = time.monotonic() + self.closed_ttl
+            self.stats["closed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Failed to DM {user.id}: {e!r}")
+
+    async def run_follow_up(self, then):
+        try:
+            await then()
+        except Exception as e:
+            print(f"DM follow-up action failed: {e!r}")
+
+    async def worker(self):
+        while True:
+            user, message, then = await self.queue.get()
+            try:
+                if then:
+                    # Don't hold the follow-up action for long on a slow DM
+                    try:
+                        await asyncio.wait_for(self.deliver(user, message), DM_FOLLOW_UP_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        self.stats["failed"] += 1
+                    await self.run_follow_up(then)
+                else:
+                    await self.deliver(user, message)
+            finally:
+                self.queue.task_done()
+
+dm_dispatcher = DMDispatcher(
+    workers=config.DM_WORKERS,
+    max_queue=config.DM_QUEUE_SIZE,
+    closed_ttl=config.DM_CLOSED_TTL
+)
+
+# Record raw gateway messages and command invocations when recording is on
+@bot.event
+async def on_socket_raw_receive(msg):
+    if event_recorder:
+        event_recorder.record(RECORD_GATEWAY, msg.encode() if isinstance(msg, str) else msg)
+
+@bot.event
+async def on_command(ctx):
+    if event_recorder:
+        event_recorder.record(RECORD_COMMAND, json.dumps({
+            "command": ctx.command.qualified_name,
+            "guild_id": ctx.guild.id if ctx.guild else None,
+            "channel_id": ctx.channel.id,
+            "author_id": ctx.author.id,
+            "content": ctx.message.content,
+        }).encode())
+
+# Role changes can change who counts as a moderator
+@bot.event
+async def on_guild_role_update(before, after):
+    permission_cache.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    permission_cache.invalidate(role.guild.id)
 
 # Bot startup event
 @bot.event
 async def on_ready():
+    global reconcile_task
     print(f'{bot.user.name} is online and ready!')
     await bot.change_presence(activity=discord.Activity(
-        type=discord.ActivityType.watching, 
+        type=discord.ActivityType.watching,
         name=f"{config.PREFIX}commands for commands"
     ))
 
+    # on_ready fires again after reconnects, so only run one reconcile at a time
+    if reconcile_task is None or reconcile_task.done():
+        reconcile_task = asyncio.create_task(reconcile_all_guilds())
+
+# Keep the moderation state cache current from gateway events
+@bot.event
+async def on_member_ban(guild, user):
+    mod_state.set_banned(guild.id, user.id, True)
+
+@bot.event
+async def on_member_unban(guild, user):
+    mod_state.set_banned(guild.id, user.id, False)
+
+@bot.event
+async def on_member_update(before, after):
+    if before.timed_out_until != after.timed_out_until:
+        mod_state.set_timeout(after.guild.id, after.id, after.timed_out_until)
+    if before.roles != after.roles:
+        voice_banned = discord.utils.get(after.roles, name=VOICE_BAN_ROLE_NAME) is not None
+        mod_state.set_voice_banned(after.guild.id, after.id, voice_banned)
+
 # Error handling
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
-        await ctx.send(f"Command not found. Use `{config.PREFIX}commands` to see available commands.")
+        await ctx.send(f"Command not found. Use `{ctx.prefix}commands` to see available commands.")
     elif isinstance(error, commands.MissingRequiredArgument):
-        await ctx.send(f"Missing required argument. Use `{config.PREFIX}commands {ctx.command}` for usage information.")
+        await ctx.send(f"Missing required argument. Use `{ctx.prefix}commands {ctx.command}` for usage information.")
     elif isinstance(error, commands.CheckFailure):
         pass  # Admin check will handle this
+    elif isinstance(getattr(error, "original", None), CoordinatorUnavailable):
+        await ctx.send("The coordinator is unreachable, so this couldn't be recorded. Try again shortly.")
     else:
         await ctx.send(f"An error occurred: {error}")
 
+# Bloom filter over strings, sized for its capacity and false positive rate
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    # Double hashing: derive every bit position from one 128-bit digest
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+# 64-bit hash of a domain, used for the compact exact-match table
+def domain_hash(domain):
+    return int.from_bytes(hashlib.blake2b(domain.encode(), digest_size=8).digest(), 'little')
+
+# Blocked domains: a Bloom filter rules most lookups out, a sorted hash table confirms hits
+class DomainBlocklist:
+    def __init__(self, domains=()):
+        domains = set(domains)
+        self.bloom = BloomFilter(len(domains))
+        for domain in domains:
+            self.bloom.add(domain)
+        self.hashes = array('Q', sorted({domain_hash(domain) for domain in domains}))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    # Load one domain per line, ignoring blank lines and # comments
+    @classmethod
+    def load(cls, path):
+        domains = set()
+        with open(path, 'r') as f:
+            for line in f:
+                domain = line.split('#', 1)[0].strip().lower().lstrip('*.').rstrip('.')
+                if domain:
+                    domains.add(domain)
+        return cls(domains)
+
+    def contains_exact(self, domain):
+        value = domain_hash(domain)
+        i = bisect_left(self.hashes, value)
+        return i < len(self.hashes) and self.hashes[i] == value
+
+    # Return the blocked domain covering a hostname (itself or a parent), or None
+    def match(self, hostname):
+        labels = hostname.lower().rstrip('.').split('.')
+        for i in range(len(labels) - 1):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.bloom and self.contains_exact(candidate):
+                return candidate
+        return None
+
+# URLs in message content
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'`|]+', re.IGNORECASE)
+
+# Most URLs checked per message
+LINK_SCAN_MAX_URLS = 10
+
+# Most redirects followed when expanding a shortened link
+LINK_EXPAND_MAX_REDIRECTS = 5
+
+# Checks message links against the blocklist, expanding shortened links over a pooled session
+class LinkScanner:
+    def __init__(self, blocklist_path, shorteners, verdict_ttl, max_verdicts):
+        self.blocklist_path = blocklist_path
+        self.shorteners = set(shorteners)
+        self.verdict_ttl = verdict_ttl
+        self.max_verdicts = max_verdicts
+        self.blocklist = DomainBlocklist()
+        self.verdicts = OrderedDict()  # url -> (blocked domain or None, expiry time)
+        self.session = None
+
+    async def start(self):
+        if os.path.exists(self.blocklist_path):
+            self.blocklist = await asyncio.get_running_loop().run_in_executor(None, DomainBlocklist.load, self.blocklist_path)
+            print(f"Loaded {len(self.blocklist)} blocked domains.")
+        else:
+            print(f"Link scanner blocklist {self.blocklist_path} not found, only shorteners will be expanded.")
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(ssl=ssl_context, limit=20, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=5)
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def cached_verdict(self, url):
+        cached = self.verdicts.get(url)
+        if cached is None:
+            return False, None
+        verdict, expires = cached
+        if expires <= time.monotonic():
+            del self.verdicts[url]
+            return False, None
+        self.verdicts.move_to_end(url)
+        return True, verdict
+
+    def store_verdict(self, url, verdict):
+        self.verdicts[url] = (verdict, time.monotonic() + self.verdict_ttl)
+        self.verdicts.move_to_end(url)
+        while len(self.verdicts) > self.max_verdicts:
+            self.verdicts.popitem(last=False)
+
+    # Only request hosts that resolve to public addresses, never the bot's own network
+    async def is_public_host(self, host):
+        try:
+            addresses = [ipaddress.ip_address(host)]
+        except ValueError:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None)
+            addresses = [ipaddress.ip_address(info[4][0]) for info in infos]
+        return bool(addresses) and all(address.is_global for address in addresses)
+
+    # Follow a shortened link's redirects by hand, checking each host before requesting it
+    # Returns (verdict, complete), where complete is False if the chain couldn't be followed
+    async def expand(self, url):
+        for _ in range(LINK_EXPAND_MAX_REDIRECTS):
+            try:
+                async with self.session.head(url, allow_redirects=False) as response:
+                    location = response.headers.get("Location")
+                    if response.status not in (301, 302, 303, 307, 308) or not location:
+                        return None, True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None, False
+
+            url = urljoin(url, location)
+            parts = urlsplit(url)
+            host = parts.hostname
+            if parts.scheme not in ("http", "https") or not host:
+                return None, True
+            verdict = self.blocklist.match(host)
+            if verdict:
+                return verdict, True
+            try:
+                if not await self.is_public_host(host):
+                    return None, True
+            except OSError:
+                return None, False  # Couldn't resolve it, try again next time
+        return None, False
+
+    async def check_url(self, url):
+        found, verdict = self.cached_verdict(url)
+        if found:
+            return verdict
+        host = urlsplit(url).hostname
+        verdict = self.blocklist.match(host) if host else None
+        complete = True
+        if verdict is None and host in self.shorteners and self.session:
+            verdict, complete = await self.expand(url)
+        # Don't cache a clean verdict for a link we couldn't expand
+        if complete:
+            self.store_verdict(url, verdict)
+        return verdict
+
+    # Return (url, blocked domain) for the first blocked link in some text, or None
+    async def scan(self, content):
+        urls = list(dict.fromkeys(URL_PATTERN.findall(content)))[:LINK_SCAN_MAX_URLS]
+        if not urls:
+            return None
+        verdicts = await asyncio.gather(*(self.check_url(url) for url in urls))
+        for url, verdict in zip(urls, verdicts):
+            if verdict:
+                return url, verdict
+        return None
+
+link_scanner = LinkScanner(
+    config.PHISHING_BLOCKLIST_FILE,
+    config.URL_SHORTENERS,
+    config.LINK_VERDICT_TTL,
+    config.LINK_VERDICT_CACHE_SIZE
+) if config.LINK_SCAN_ENABLED else None
+
+# Remove messages with blocked links and warn their authors
+@bot.listen('on_message')
+async def scan_message_links(message):
+    if not link_scanner or message.author.bot or message.guild is None:
+        return
+    if 'http' not in message.content.lower():
+        return
+    if permission_cache.is_moderator(message.author):
+        return
+
+    hit = await link_scanner.scan(message.content)
+    if hit is None:
+        return
+    url, domain = hit
+
+    try:
+        await message.delete()
+    except (discord.Forbidden, discord.NotFound):
+        pass
+
+    # Send to modlog
+    await send_to_modlog(
+        message.guild,
+        "Blocked Link Removed",
+        f"**User:** {message.author.mention} ({message.author})\n"
+        f"**Channel:** {message.channel.mention}\n"
+        f"**Link:** `{url}`\n"
+        f"**Blocked domain:** {domain}\n"
+        f"**Moderator:** Automatic system",
+        discord.Color.dark_red()
+    )
+    await add_warning(message.guild, message.channel, message.author, f"Posted a blocked link ({domain})", bot.user)
+
+# 64-bit difference hash of an image: similar images differ in only a few bits
+# Runs inside a worker process, so it must stay a plain top-level function
+def perceptual_hash(data):
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            right = pixels[row * 9 + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+# BK-tree over Hamming distance, for finding hashes within a few bits of a query
+class BKTree:
+    def __init__(self):
+        self.root = None  # [value, {distance: child node}]
+        self.size = 0
+
+    def add(self, value):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return  # Already present
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    # Return (distance, value) of the closest stored value within max_distance, or None
+    def find(self, value, max_distance):
+        best = None
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, node[0])
+            # Triangle inequality: only children in this band can be close enough
+            for child_distance, child in node[1].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return best
+
+# Image attachment types worth hashing
+SCANNED_IMAGE_TYPES = ("image/png", "image/jpeg", "image/webp", "image/gif", "image/bmp")
+
+# Most attachments checked per message
+IMAGE_SCAN_MAX_ATTACHMENTS = 5
+
+# Matches image attachments against known bad images by perceptual hash
+class ImageScanner:
+    def __init__(self, hashes_path, max_distance, max_bytes, max_downloads, workers, cache_size):
+        self.hashes_path = hashes_path
+        self.max_distance = max_distance
+        self.max_bytes = max_bytes
+        self.download_slots = asyncio.Semaphore(max_downloads)
+        self.workers = workers
+        self.cache_size = cache_size
+        self.executor = None
+        self.tree = BKTree()
+        self.hash_cache = OrderedDict()  # sha256 of attachment bytes -> perceptual hash
+        self.load()
+
+    # Read the hash file, keeping hashes already loaded (the tree ignores duplicates)
+    def load(self):
+        if not os.path.exists(self.hashes_path):
+            return
+        with open(self.hashes_path, 'r') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    self.tree.add(int(line, 16))
+
+    # Add a hash to the set and the hash file
+    def block(self, value):
+        before = self.tree.size
+        self.tree.add(value)
+        if self.tree.size != before:
+            with open(self.hashes_path, 'a') as f:
+                f.write(f"{value:016x}\n")
+
+    # Download an attachment and compute its perceptual hash, reusing earlier results for identical files
+    async def hash_attachment(self, attachment):
+        async with self.download_slots:
+            data = await attachment.read()
+        digest = hashlib.sha256(data).digest()
+        value = self.hash_cache.get(digest)
+        if value is not None:
+            self.hash_cache.move_to_end(digest)
+            return value
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        value = await asyncio.get_running_loop().run_in_executor(self.executor, perceptual_hash, data)
+        self.hash_cache[digest] = value
+        while len(self.hash_cache) > self.cache_size:
+            self.hash_cache.popitem(last=False)
+        return value
+
+    def is_scannable(self, attachment):
+        return (attachment.content_type or "").split(';')[0] in SCANNED_IMAGE_TYPES and attachment.size <= self.max_bytes
+
+    # Return (attachment, distance) for the first attachment matching a bad image, or None
+    async def scan(self, attachments):
+        attachments = [attachment for attachment in attachments if self.is_scannable(attachment)][:IMAGE_SCAN_MAX_ATTACHMENTS]
+        if not attachments or self.tree.size == 0:
+            return None
+        results = await asyncio.gather(*(self.hash_attachment(attachment) for attachment in attachments), return_exceptions=True)
+        for attachment, value in zip(attachments, results):
+            if isinstance(value, Exception):
+                continue  # Unreadable or undownloadable image
+            match = self.tree.find(value, self.max_distance)
+            if match:
+                return attachment, match[0]
+        return None
+
+if config.IMAGE_SCAN_ENABLED and Image is None:
+    print("IMAGE_SCAN_ENABLED is set but Pillow isn't installed, attachment scanning is off.")
+
+image_scanner = ImageScanner(
+    config.BAD_IMAGE_HASHES_FILE,
+    config.IMAGE_MATCH_DISTANCE,
+    config.IMAGE_SCAN_MAX_BYTES,
+    config.IMAGE_SCAN_DOWNLOADS,
+    config.IMAGE_SCAN_WORKERS,
+    config.IMAGE_HASH_CACHE_SIZE
+) if config.IMAGE_SCAN_ENABLED and Image is not None else None
+
+# Remove messages with known bad images and warn their authors
+@bot.listen('on_message')
+async def scan_message_attachments(message):
+    if not image_scanner or not message.attachments or message.author.bot or message.guild is None:
+        return
+    if permission_cache.is_moderator(message.author):
+        return
+
+    hit = await image_scanner.scan(message.attachments)
+    if hit is None:
+        return
+    attachment, distance = hit
+
+    try:
+        await message.delete()
+    except (discord.Forbidden, discord.NotFound):
+        pass
+
+    # Send to modlog
+    await send_to_modlog(
+        message.guild,
+        "Blocked Image Removed",
+        f"**User:** {message.author.mention} ({message.author})\n"
+        f"**Channel:** {message.channel.mention}\n"
+        f"**File:** {attachment.filename}\n"
+        f"**Hash distance:** {distance}\n"
+        f"**Moderator:** Automatic system",
+        discord.Color.dark_red()
+    )
+    await add_warning(message.guild, message.channel, message.author, "Posted a blocked image", bot.user)
+
+# Record a warning, applying the auto-timeout once the guild's limit is reached
+# Status messages go to `channel`; `moderator` is whoever issued the warning
+async def add_warning(guild, channel, user, reason, moderator):
+    user_id = user.id
+    if str(user_id) not in warnings_db:
+        warnings_db[str(user_id)] = []
+    
+    warning_data = {
+        "reason": reason,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "warned_by": moderator.id
+    }
+    
+    warnings_db[str(user_id)].append(warning_data)
+    await sync_warnings(user_id, "add", warning_data)
+    
+    # Check for auto-timeout
+    # Skip if already timed out so repeated warns don't re-apply the timeout
+    max_warnings = guild_config.get(guild.id, "max_warnings")
+    if len(warnings_db[str(user_id)]) >= max_warnings and mod_state.timed_out_until(guild.id, user_id) is None:
+        member = await resolve_member(guild, user_id)
+        if member:
+            auto_timeout_duration = guild_config.get(guild.id, "auto_timeout_duration")
+            duration_display = f"{auto_timeout_duration / 3600:g} hours"
+            timeout_until = discord.utils.utcnow() + datetime.timedelta(seconds=auto_timeout_duration)
+            try:
+                await member.timeout(timeout_until, reason="Automatic timeout after reaching warning limit")
+                mod_state.set_timeout(guild.id, user_id, timeout_until)
+                await channel.send(f"{user.mention} has been automatically timed out for {duration_display} after reaching {max_warnings} warnings.")
+                
+                # Record the case
+                case_id = await record_case(guild, "auto-timeout", user, bot.user, f"Reached {max_warnings} warnings", duration=duration_display)
+
+                # Send to modlog
+                await send_to_modlog(
+                    guild,
+                    "Auto-Timeout Applied",
+                    f"**User:** {user.mention} ({user.name}#{user.discriminator})\n"
+                    f"**Reason:** Reached {max_warnings} warnings\n"
+                    f"**Duration:** {duration_display}\n"
+                    f"**Moderator:** Automatic system",
+                    discord.Color.dark_red(),
+                    case_id=case_id
+                )
+            except discord.Forbidden:
+                await channel.send("I don't have permission to timeout that user.")
+    
+    await channel.send(f"Warning added for {user.mention}. They now have {len(warnings_db[str(user_id)])} warning(s).")
+    
+    # Record the case
+    case_id = await record_case(guild, "warn", user, moderator, reason)
+
+    # Send to modlog
+    await send_to_modlog(
+        guild,
+        "User Warned",
+        f"**User:** {user.mention} ({user})\n"
+        f"**Reason:** {reason}\n"
+        f"**Warned by:** {moderator.mention}\n"
+        f"**Warning count:** {len(warnings_db[str(user_id)])}",
+        discord.Color.orange(),
+        case_id=case_id
+    )
+    
+    # Queue a DM for the user without waiting on delivery
+    dm_dispatcher.notify(user, f"You have been warned in {guild.name} for: {reason}")
+
 # WARN COMMAND
 @bot.command(name="warn")
 @admin_only()
@@ -119,58 +2079,7 @@ async def warn(ctx, user_id: str, *, reason=None):
         if not reason:
             reason = config.DEFAULT_REASON
         
-        if str(user_id) not in warnings_db:
-            warnings_db[str(user_id)] = []
-        
-        warning_data = {
-            "reason": reason,
-            "timestamp": datetime.datetime.now().isoformat(),
-            "warned_by": ctx.author.id
-        }
-        
-        warnings_db[str(user_id)].append(warning_data)
-        save_warnings()
-        
-        # Check for auto-timeout
-        if len(warnings_db[str(user_id)]) >= config.MAX_WARNINGS:
-            member = ctx.guild.get_member(user_id)
-            if member:
-                timeout_until = datetime.datetime.now() + datetime.timedelta(seconds=config.AUTO_TIMEOUT_DURATION)
-                try:
-                    await member.timeout(timeout_until, reason="Automatic timeout after reaching warning limit")
-                    await ctx.send(f"{user.mention} has been automatically timed out for 24 hours after reaching {config.MAX_WARNINGS} warnings.")
-                    
-                    # Send to modlog
-                    await send_to_modlog(
-                        ctx.guild,
-                        "Auto-Timeout Applied",
-                        f"**User:** {user.mention} ({user.name}#{user.discriminator})\n"
-                        f"**Reason:** Reached {config.MAX_WARNINGS} warnings\n"
-                        f"**Duration:** 24 hours\n"
-                        f"**Moderator:** Automatic system",
-                        discord.Color.dark_red()
-                    )
-                except discord.Forbidden:
-                    await ctx.send("I don't have permission to timeout that user.")
-        
-        await ctx.send(f"Warning added for {user.mention}. They now have {len(warnings_db[str(user_id)])} warning(s).")
-        
-        # Send to modlog
-        await send_to_modlog(
-            ctx.guild,
-            "User Warned",
-            f"**User:** {user.mention} ({user})\n"
-            f"**Reason:** {reason}\n"
-            f"**Warned by:** {ctx.author.mention}\n"
-            f"**Warning count:** {len(warnings_db[str(user_id)])}",
-            discord.Color.orange()
-        )
-        
-        # Try to DM the user
-        try:
-            await user.send(f"You have been warned in {ctx.guild.name} for: {reason}")
-        except discord.Forbidden:
-            pass  # User has DMs closed
+        await add_warning(ctx.guild, ctx.channel, user, reason, ctx.author)
             
     except ValueError:
         await ctx.send("Invalid user ID format. Please use a valid ID.")
@@ -194,10 +2103,13 @@ async def unwarn(ctx, user_id: str, *, reason=None):
         
         # Remove the most recent warning
         warnings_db[str(user_id)].pop()
-        save_warnings()
+        await sync_warnings(user_id, "remove")
         
         await ctx.send(f"Warning removed from {user.mention}. They now have {len(warnings_db[str(user_id)])} warning(s).")
         
+        # Record the case
+        case_id = await record_case(ctx.guild, "unwarn", user, ctx.author, reason)
+
         # Send to modlog
         await send_to_modlog(
             ctx.guild,
@@ -206,7 +2118,8 @@ async def unwarn(ctx, user_id: str, *, reason=None):
             f"**Reason:** {reason}\n"
             f"**Removed by:** {ctx.author.mention}\n"
             f"**Remaining warnings:** {len(warnings_db[str(user_id)])}",
-            discord.Color.green()
+            discord.Color.green(),
+            case_id=case_id
         )
             
     except ValueError:
@@ -229,9 +2142,8 @@ async def timeout(ctx, user_id: str, duration: str, *, reason=None):
 
         # Convert user ID and fetch member
         user_id = int(user_id.strip('"<@!>'))
-        try:
-            member = await ctx.guild.fetch_member(user_id)  # ✅ Fetch member properly
-        except discord.NotFound:
+        member = await resolve_member(ctx.guild, user_id)
+        if not member:
             return await ctx.send("⚠️ User not found in this server.")
 
         # Check if bot can timeout the user
@@ -265,11 +2177,15 @@ async def timeout(ctx, user_id: str, duration: str, *, reason=None):
 
         # Apply timeout
         await member.edit(timed_out_until=timeout_until, reason=reason)
+        mod_state.set_timeout(ctx.guild.id, member.id, timeout_until)
 
         # Format duration for display
         duration_display = f"{value} {unit}"
         await ctx.send(f"✅ {member.mention} has been timed out for {duration_display}.")
 
+        # Record the case
+        case_id = await record_case(ctx.guild, "timeout", member, ctx.author, reason, duration=duration_display)
+
         # Send modlog (Optional)
         await send_to_modlog(
             ctx.guild,
@@ -278,14 +2194,12 @@ async def timeout(ctx, user_id: str, duration: str, *, reason=None):
             f"**Duration:** {duration_display}\n"
             f"**Reason:** {reason}\n"
             f"**Moderator:** {ctx.author.mention}",
-            discord.Color.red()
+            discord.Color.red(),
+            case_id=case_id
         )
 
-        # Try to DM the user
-        try:
-            await member.send(f"You have been timed out in {ctx.guild.name} for {duration_display}. Reason: {reason}")
-        except discord.Forbidden:
-            pass  # User has DMs closed
+        # Queue a DM for the user without waiting on delivery
+        dm_dispatcher.notify(member, f"You have been timed out in {ctx.guild.name} for {duration_display}. Reason: {reason}")
 
     except ValueError:
         await ctx.send("⚠️ Invalid user ID format. Please use a valid ID.")
@@ -300,7 +2214,7 @@ async def timeout(ctx, user_id: str, duration: str, *, reason=None):
 async def untimeout(ctx, user_id: str):
     try:
         user_id = int(user_id.strip('"<@!>'))
-        member = ctx.guild.get_member(user_id)
+        member = await resolve_member(ctx.guild, user_id)
         
         if not member:
             await ctx.send("User not found in this server.")
@@ -308,22 +2222,24 @@ async def untimeout(ctx, user_id: str):
             
         try:
             await member.timeout(None, reason="Timeout removed by moderator")
+            mod_state.set_timeout(ctx.guild.id, member.id, None)
             await ctx.send(f"Timeout removed for {member.mention}.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "untimeout", member, ctx.author, None)
+
             # Send to modlog
             await send_to_modlog(
                 ctx.guild,
                 "Timeout Removed",
                 f"**User:** {member.mention} ({member})\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.green()
+                discord.Color.green(),
+                case_id=case_id
             )
             
-            # Try to DM the user
-            try:
-                await member.send(f"Your timeout in {ctx.guild.name} has been removed by a moderator.")
-            except discord.Forbidden:
-                pass  # User has DMs closed
+            # Queue a DM for the user without waiting on delivery
+            dm_dispatcher.notify(member, f"Your timeout in {ctx.guild.name} has been removed by a moderator.")
                 
         except discord.Forbidden:
             await ctx.send("I don't have permission to remove timeout for that user.")
@@ -344,8 +2260,12 @@ async def ban(ctx, user_id: str, days: int = 0, *, reason=None):
             
         try:
             await ctx.guild.ban(user, reason=reason, delete_message_days=days)
+            mod_state.set_banned(ctx.guild.id, user.id, True)
             await ctx.send(f"{user.mention} has been banned from the server.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "ban", user, ctx.author, reason, delete_message_days=days)
+
             # Send to modlog
             delete_msg = f"Deleted {days} days of messages" if days > 0 else "No messages deleted"
             await send_to_modlog(
@@ -355,14 +2275,12 @@ async def ban(ctx, user_id: str, days: int = 0, *, reason=None):
                 f"**Reason:** {reason}\n"
                 f"**{delete_msg}**\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.dark_red()
+                discord.Color.dark_red(),
+                case_id=case_id
             )
             
-            # Try to DM the user
-            try:
-                await user.send(f"You have been banned from {ctx.guild.name}. Reason: {reason}")
-            except discord.Forbidden:
-                pass  # User has DMs closed
+            # Queue a DM for the user without waiting on delivery
+            dm_dispatcher.notify(user, f"You have been banned from {ctx.guild.name}. Reason: {reason}")
                 
         except discord.Forbidden:
             await ctx.send("I don't have permission to ban that user.")
@@ -385,8 +2303,12 @@ async def unban(ctx, user_id: str, *, reason=None):
         try:
             user = await bot.fetch_user(user_id)
             await ctx.guild.unban(user, reason=reason)
+            mod_state.set_banned(ctx.guild.id, user.id, False)
             await ctx.send(f"{user.mention} has been unbanned from the server.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "unban", user, ctx.author, reason)
+
             # Send to modlog
             await send_to_modlog(
                 ctx.guild,
@@ -394,7 +2316,8 @@ async def unban(ctx, user_id: str, *, reason=None):
                 f"**User:** {user.mention} ({user})\n"
                 f"**Reason:** {reason}\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.green()
+                discord.Color.green(),
+                case_id=case_id
             )
                 
         except discord.NotFound:
@@ -411,7 +2334,7 @@ async def unban(ctx, user_id: str, *, reason=None):
 async def kick(ctx, user_id: str, *, reason=None):
     try:
         user_id = int(user_id.strip('"<@!>'))
-        member = ctx.guild.get_member(user_id)
+        member = await resolve_member(ctx.guild, user_id)
         
         if not member:
             await ctx.send("User not found in this server.")
@@ -420,16 +2343,26 @@ async def kick(ctx, user_id: str, *, reason=None):
         if not reason:
             reason = config.DEFAULT_REASON
             
-        try:
-            # Try to DM the user before kicking
+        # Check up front, since the kick itself runs in the background after the DM
+        me = ctx.guild.me
+        if not me.guild_permissions.kick_members or member == ctx.guild.owner or member.top_role >= me.top_role:
+            await ctx.send("I don't have permission to kick that user.")
+            return
+
+        async def kick_member():
             try:
-                await member.send(f"You have been kicked from {ctx.guild.name}. Reason: {reason}")
-            except discord.Forbidden:
-                pass  # User has DMs closed
-                
-            await member.kick(reason=reason)
+                await member.kick(reason=reason)
+            except discord.HTTPException as e:
+                await ctx.send(f"Failed to kick {member.mention}: {e.text or e}")
+
+        try:
+            # The user can't receive the DM once they share no server with us, so kick after it
+            dm_dispatcher.notify(member, f"You have been kicked from {ctx.guild.name}. Reason: {reason}", then=kick_member)
             await ctx.send(f"{member.mention} has been kicked from the server.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "kick", member, ctx.author, reason)
+
             # Send to modlog
             await send_to_modlog(
                 ctx.guild,
@@ -437,7 +2370,8 @@ async def kick(ctx, user_id: str, *, reason=None):
                 f"**User:** {member.mention} ({member})\n"
                 f"**Reason:** {reason}\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.orange()
+                discord.Color.orange(),
+                case_id=case_id
             )
                 
         except discord.Forbidden:
@@ -452,7 +2386,7 @@ async def kick(ctx, user_id: str, *, reason=None):
 async def voiceban(ctx, user_id: str, *, reason=None):
     try:
         user_id = int(user_id.strip('"<@!>'))
-        member = ctx.guild.get_member(user_id)
+        member = await resolve_member(ctx.guild, user_id)
         
         if not member:
             await ctx.send("User not found in this server.")
@@ -463,10 +2397,10 @@ async def voiceban(ctx, user_id: str, *, reason=None):
             
         try:
             # Create or get voice ban role
-            voice_ban_role = discord.utils.get(ctx.guild.roles, name="Voice Banned")
+            voice_ban_role = discord.utils.get(ctx.guild.roles, name=VOICE_BAN_ROLE_NAME)
             if not voice_ban_role:
                 voice_ban_role = await ctx.guild.create_role(
-                    name="Voice Banned",
+                    name=VOICE_BAN_ROLE_NAME,
                     reason="Role for users banned from voice channels"
                 )
                 
@@ -480,6 +2414,7 @@ async def voiceban(ctx, user_id: str, *, reason=None):
                     )
             
             await member.add_roles(voice_ban_role, reason=reason)
+            mod_state.set_voice_banned(ctx.guild.id, member.id, True)
             
             # Disconnect from voice if currently in a voice channel
             if member.voice and member.voice.channel:
@@ -487,6 +2422,9 @@ async def voiceban(ctx, user_id: str, *, reason=None):
                 
             await ctx.send(f"{member.mention} has been banned from voice channels.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "voiceban", member, ctx.author, reason)
+
             # Send to modlog
             await send_to_modlog(
                 ctx.guild,
@@ -494,14 +2432,12 @@ async def voiceban(ctx, user_id: str, *, reason=None):
                 f"**User:** {member.mention} ({member})\n"
                 f"**Reason:** {reason}\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.purple()
+                discord.Color.purple(),
+                case_id=case_id
             )
             
-            # Try to DM the user
-            try:
-                await member.send(f"You have been banned from voice channels in {ctx.guild.name}. Reason: {reason}")
-            except discord.Forbidden:
-                pass  # User has DMs closed
+            # Queue a DM for the user without waiting on delivery
+            dm_dispatcher.notify(member, f"You have been banned from voice channels in {ctx.guild.name}. Reason: {reason}")
                 
         except discord.Forbidden:
             await ctx.send("I don't have permission to manage roles or move that user.")
@@ -515,7 +2451,7 @@ async def voiceban(ctx, user_id: str, *, reason=None):
 async def voiceunban(ctx, user_id: str, *, reason=None):
     try:
         user_id = int(user_id.strip('"<@!>'))
-        member = ctx.guild.get_member(user_id)
+        member = await resolve_member(ctx.guild, user_id)
         
         if not member:
             await ctx.send("User not found in this server.")
@@ -526,7 +2462,7 @@ async def voiceunban(ctx, user_id: str, *, reason=None):
             
         try:
             # Find voice ban role
-            voice_ban_role = discord.utils.get(ctx.guild.roles, name="Voice Banned")
+            voice_ban_role = discord.utils.get(ctx.guild.roles, name=VOICE_BAN_ROLE_NAME)
             if not voice_ban_role:
                 await ctx.send("Voice ban role doesn't exist.")
                 return
@@ -536,8 +2472,12 @@ async def voiceunban(ctx, user_id: str, *, reason=None):
                 return
                 
             await member.remove_roles(voice_ban_role, reason=reason)
+            mod_state.set_voice_banned(ctx.guild.id, member.id, False)
             await ctx.send(f"{member.mention} has been unbanned from voice channels.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "voiceunban", member, ctx.author, reason)
+
             # Send to modlog
             await send_to_modlog(
                 ctx.guild,
@@ -545,14 +2485,12 @@ async def voiceunban(ctx, user_id: str, *, reason=None):
                 f"**User:** {member.mention} ({member})\n"
                 f"**Reason:** {reason}\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.green()
+                discord.Color.green(),
+                case_id=case_id
             )
             
-            # Try to DM the user
-            try:
-                await member.send(f"You have been unbanned from voice channels in {ctx.guild.name}.")
-            except discord.Forbidden:
-                pass  # User has DMs closed
+            # Queue a DM for the user without waiting on delivery
+            dm_dispatcher.notify(member, f"You have been unbanned from voice channels in {ctx.guild.name}.")
                 
         except discord.Forbidden:
             await ctx.send("I don't have permission to manage roles for that user.")
@@ -566,7 +2504,7 @@ async def voiceunban(ctx, user_id: str, *, reason=None):
 async def voicekick(ctx, user_id: str, *, reason=None):
     try:
         user_id = int(user_id.strip('"<@!>'))
-        member = ctx.guild.get_member(user_id)
+        member = await resolve_member(ctx.guild, user_id)
         
         if not member:
             await ctx.send("User not found in this server.")
@@ -580,26 +2518,28 @@ async def voicekick(ctx, user_id: str, *, reason=None):
             return
             
         try:
-            # Disconnect from voice
+            # Disconnect from voice, remembering the channel before it's cleared
+            channel_name = member.voice.channel.name
             await member.move_to(None, reason=reason)
             await ctx.send(f"{member.mention} has been kicked from the voice channel.")
             
+            # Record the case
+            case_id = await record_case(ctx.guild, "voicekick", member, ctx.author, reason, channel=channel_name)
+
             # Send to modlog
             await send_to_modlog(
                 ctx.guild,
                 "User Voice Kicked",
                 f"**User:** {member.mention} ({member})\n"
-                f"**Channel:** {member.voice.channel.name}\n"
+                f"**Channel:** {channel_name}\n"
                 f"**Reason:** {reason}\n"
                 f"**Moderator:** {ctx.author.mention}",
-                discord.Color.orange()
+                discord.Color.orange(),
+                case_id=case_id
             )
             
-            # Try to DM the user
-            try:
-                await member.send(f"You have been kicked from voice channels in {ctx.guild.name}. Reason: {reason}")
-            except discord.Forbidden:
-                pass  # User has DMs closed
+            # Queue a DM for the user without waiting on delivery
+            dm_dispatcher.notify(member, f"You have been kicked from voice channels in {ctx.guild.name}. Reason: {reason}")
                 
         except discord.Forbidden:
             await ctx.send("I don't have permission to disconnect that user.")
@@ -616,25 +2556,12 @@ async def mywarnings(ctx):
         await ctx.send("You have no warnings.")
         return
         
-    embed = discord.Embed(
-        title="Your Warnings",
-        description=f"You have {len(warnings_db[user_id])} warning(s)",
-        color=discord.Color.orange()
+    await send_warnings(
+        ctx,
+        "Your Warnings",
+        f"You have {len(warnings_db[user_id])} warning(s)",
+        warnings_db[user_id]
     )
-    
-    for i, warning in enumerate(warnings_db[user_id], 1):
-        warner = await bot.fetch_user(warning.get("warned_by"))
-        warner_name = f"{warner}" if warner else "Unknown"
-        
-        embed.add_field(
-            name=f"Warning {i}",
-            value=f"**Reason:** {warning.get('reason', 'No reason provided')}\n"
-                 f"**Warned by:** {warner_name}\n"
-                 f"**Date:** {warning.get('timestamp', 'Unknown')}",
-            inline=False
-        )
-        
-    await ctx.send(embed=embed)
 
 # WARNINGS COMMAND
 @bot.command(name="warnings")
@@ -648,25 +2575,17 @@ async def warnings(ctx, user_id: str):
             await ctx.send(f"{user.mention} has no warnings.")
             return
             
-        embed = discord.Embed(
-            title=f"Warnings for {user}",
-            description=f"This user has {len(warnings_db[user_id])} warning(s)",
-            color=discord.Color.orange()
+        description = f"This user has {len(warnings_db[user_id])} warning(s)"
+        status = mod_state.describe(ctx.guild.id, int(user_id))
+        if status:
+            description += f"\n**Status:** {status}"
+
+        await send_warnings(
+            ctx,
+            f"Warnings for {user}",
+            description,
+            warnings_db[user_id]
         )
-        
-        for i, warning in enumerate(warnings_db[user_id], 1):
-            warner = await bot.fetch_user(warning.get("warned_by"))
-            warner_name = f"{warner}" if warner else "Unknown"
-            
-            embed.add_field(
-                name=f"Warning {i}",
-                value=f"**Reason:** {warning.get('reason', 'No reason provided')}\n"
-                     f"**Warned by:** {warner_name}\n"
-                     f"**Date:** {warning.get('timestamp', 'Unknown')}",
-                inline=False
-            )
-            
-        await ctx.send(embed=embed)
             
     except ValueError:
         await ctx.send("Invalid user ID format. Please use a valid ID.")
@@ -679,7 +2598,7 @@ async def warnings(ctx, user_id: str):
 async def userinfo(ctx, user_id: str):
     try:
         user_id = int(user_id.strip('"<@!>'))
-        member = ctx.guild.get_member(user_id)
+        member = await resolve_member(ctx.guild, user_id)
         
         if not member:
             user = await bot.fetch_user(user_id)
@@ -695,6 +2614,16 @@ async def userinfo(ctx, user_id: str):
             # Add warnings info if available
             if str(user_id) in warnings_db:
                 embed.add_field(name="Warnings", value=len(warnings_db[str(user_id)]), inline=True)
+
+            # Add moderation status from the local state cache
+            status = mod_state.describe(ctx.guild.id, user_id)
+            if status:
+                embed.add_field(name="Moderation Status", value=status, inline=True)
+
+            # Add the case count from the case log
+            cases = case_log.summary(ctx.guild.id, user_id)
+            if cases:
+                embed.add_field(name="Cases", value=cases, inline=True)
             
             await ctx.send(embed=embed)
             return
@@ -727,6 +2656,16 @@ async def userinfo(ctx, user_id: str):
         # Add warnings info if available
         if str(user_id) in warnings_db:
             embed.add_field(name="Warnings", value=len(warnings_db[str(user_id)]), inline=True)
+
+        # Add moderation status from the local state cache
+        status = mod_state.describe(ctx.guild.id, user_id)
+        if status:
+            embed.add_field(name="Moderation Status", value=status, inline=True)
+
+        # Add the case count from the case log
+        cases = case_log.summary(ctx.guild.id, user_id)
+        if cases:
+            embed.add_field(name="Cases", value=cases, inline=True)
             
         embed.add_field(name="Roles", value=roles_str, inline=False)
         
@@ -740,9 +2679,69 @@ async def userinfo(ctx, user_id: str):
     except discord.NotFound:
         await ctx.send("User not found.")
 
+# CASE COMMAND
+@bot.command(name="case")
+@admin_only()
+async def case(ctx, case_id: int):
+    case = case_log.get(case_id)
+    if not case or case["guild_id"] != ctx.guild.id:
+        await ctx.send(f"Case #{case_id} not found.")
+        return
+
+    user_name = await resolve_user_name(case["user_id"])
+    embed = discord.Embed(
+        title=f"Case #{case_id} - {user_name}",
+        description=await format_case(case),
+        color=discord.Color.orange()
+    )
+    embed.add_field(name="User ID", value=case["user_id"], inline=True)
+    await ctx.send(embed=embed)
+
+# HISTORY COMMAND
+@bot.command(name="history")
+@admin_only()
+async def history(ctx, user_id: str):
+    try:
+        user_id = int(user_id.strip('"<@!>'))
+    except ValueError:
+        await ctx.send("Invalid user ID format. Please use a valid ID.")
+        return
+
+    case_list = case_log.for_user(ctx.guild.id, user_id)[::-1]
+    if not case_list:
+        await ctx.send(f"<@{user_id}> has no moderation cases.")
+        return
+
+    title = f"Cases for {await resolve_user_name(user_id)} ({len(case_list)})"
+    page_count = -(-len(case_list) // CASES_PER_PAGE)
+    await send_paginated(ctx, page_count, functools.partial(render_history_page, title, case_list))
+
+# REASON COMMAND
+@bot.command(name="reason")
+@admin_only()
+async def reason(ctx, case_id: int, *, new_reason: str):
+    case = case_log.get(case_id)
+    if not case or case["guild_id"] != ctx.guild.id:
+        await ctx.send(f"Case #{case_id} not found.")
+        return
+
+    await edit_case_reason(case_id, new_reason, ctx.author)
+    await ctx.send(f"Updated the reason for case #{case_id}.")
+    await send_to_modlog(
+        ctx.guild,
+        "Case Reason Updated",
+        f"**Case:** #{case_id}\n**Moderator:** {ctx.author.mention}\n**New Reason:** {new_reason}",
+        case_id=case_id
+    )
+
 # INFO COMMAND
 @bot.command(name="info")
 async def info(ctx):
+    embed = await get_cached_embed("info", build_info_embed)
+    await ctx.send(embed=embed)
+
+# Build the static bot information embed
+async def build_info_embed():
     user_id = 974206310058967060  # Your user ID
     user = await bot.fetch_user(user_id)  # Fetch user details
 
@@ -761,11 +2760,286 @@ async def info(ctx):
     if user:
         embed.set_thumbnail(url=user.avatar.url)  # Display your profile picture
 
+    return embed
+
+# DMSTATS COMMAND
+@bot.command(name="dmstats")
+@admin_only()
+async def dmstats(ctx):
+    stats = dm_dispatcher.stats
+    embed = discord.Embed(title="DM Delivery Stats", color=discord.Color.blue())
+    embed.add_field(name="Sent", value=stats["sent"], inline=True)
+    embed.add_field(name="DMs Closed", value=stats["closed"], inline=True)
+    embed.add_field(name="Failed", value=stats["failed"], inline=True)
+    embed.add_field(name="Skipped (closed cache)", value=stats["skipped"], inline=True)
+    embed.add_field(name="Dropped (queue full)", value=stats["dropped"], inline=True)
+    embed.add_field(name="Queued", value=dm_dispatcher.queue.qsize(), inline=True)
+    embed.add_field(name="Known closed DMs", value=len(dm_dispatcher.closed_until), inline=True)
+    await ctx.send(embed=embed)
+
+# Python types that make up the bot's own caches
+CONTAINER_TYPES = (dict, list, set, frozenset, tuple, deque)
+
+# Size in bytes of a cache made of plain containers, counting shared objects once
+def deep_sizeof(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, CONTAINER_TYPES):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__') or hasattr(obj, '__dict__'):
+        # Count an object's own plain fields, but don't follow references into discord.py state
+        fields = list(getattr(obj, '__dict__', {}).values())
+        fields += [getattr(obj, name, None) for name in getattr(type(obj), '__slots__', ())]
+        for value in fields:
+            if isinstance(value, (str, bytes, int, float)) or isinstance(value, CONTAINER_TYPES):
+                size += deep_sizeof(value, seen)
+    return size
+
+# Estimate a large collection's size from a sample of its items
+def sampled_sizeof(items, count, sample_size=200):
+    sample = []
+    for item in items:
+        sample.append(item)
+        if len(sample) >= sample_size:
+            break
+    if not sample:
+        return 0
+    return deep_sizeof(sample) * count // len(sample)
+
+# Format a byte count for display
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+# MEMORY COMMAND
+@bot.command(name="memory")
+@admin_only()
+async def memory(ctx):
+    member_count = sum(len(guild.members) for guild in bot.guilds)
+    all_members = (member for guild in bot.guilds for member in guild.members)
+    messages = bot.cached_messages
+
+    caches = [
+        ("Members", member_count, sampled_sizeof(all_members, member_count)),
+        ("Users", len(bot.users), sampled_sizeof(bot.users, len(bot.users))),
+        ("Messages", len(messages), sampled_sizeof(messages, len(messages))),
+        ("Warnings", len(warnings_db), deep_sizeof(warnings_db)),
+        ("Moderation state", len(mod_state.reconciled), deep_sizeof(mod_state)),
+        ("Permissions", len(permission_cache.guilds), deep_sizeof(permission_cache.guilds)),
+        ("Guild config", len(guild_config.settings), deep_sizeof(guild_config.settings)),
+        ("Embeds", len(embed_cache), deep_sizeof(embed_cache)),
+        ("Closed DMs", len(dm_dispatcher.closed_until), deep_sizeof(dm_dispatcher.closed_until)),
+        ("Command limiter", len(command_limiter.slots) + len(command_limiter.buckets), deep_sizeof([command_limiter.slots, command_limiter.buckets])),
+    ]
+    if audio_cache:
+        caches.append(("Audio cache index", len(audio_cache.entries), deep_sizeof(audio_cache.entries)))
+    if loudness_cache:
+        caches.append(("Loudness gains", len(loudness_cache.gains), deep_sizeof(loudness_cache.gains)))
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    unchunked = sum(1 for guild in bot.guilds if guild.id not in chunked_guilds and not guild.chunked)
+
+    embed = discord.Embed(
+        title="Memory Usage",
+        description=f"**Cache profile:** {config.CACHE_PROFILE}\n"
+                    f"**Peak RSS:** {format_bytes(peak_rss)}\n"
+                    f"**Unchunked guilds:** {unchunked}/{len(bot.guilds)}",
+        color=discord.Color.blue()
+    )
+    for name, count, size in caches:
+        embed.add_field(name=name, value=f"{count} entries\n≈ {format_bytes(size)}", inline=True)
+    embed.set_footer(text="Sizes are estimates; discord.py objects are sampled.")
+    await ctx.send(embed=embed)
+
+# Longest window ?profile accepts, in seconds
+PROFILE_MAX_SECONDS = 300
+
+# Stack frames kept per allocation while tracemalloc is on
+PROFILE_TRACEBACK_FRAMES = 5
+
+# Set while a ?profile window is running
+profile_running = False
+
+# Summarize the top functions by own time and the biggest allocation growth
+def format_profile_summary(profiler, before, after, limit=15):
+    stats = pstats.Stats(profiler)
+    lines = [f"Top {limit} functions by own time:"]
+    top_functions = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    for (filename, line, name), (_, calls, own_time, cumulative_time, _) in top_functions:
+        lines.append(f"{own_time:8.3f}s own {cumulative_time:8.3f}s cum {calls:8d} calls  {name} ({os.path.basename(filename)}:{line})")
+
+    lines.append("")
+    lines.append(f"Top {limit} allocation sites by growth:")
+    for stat in after.compare_to(before, 'lineno')[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{format_bytes(stat.size_diff):>10} {stat.count_diff:+8d} blocks  {os.path.basename(frame.filename)}:{frame.lineno}")
+    return "\n".join(lines)
+
+# PROFILE COMMAND
+@bot.command(name="profile")
+@admin_only()
+async def profile(ctx, seconds: int = 30):
+    global profile_running
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        await ctx.send(f"Duration must be between 1 and {PROFILE_MAX_SECONDS} seconds.")
+        return
+    if profile_running:
+        await ctx.send("A profile is already running.")
+        return
+
+    profile_running = True
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+
+        await ctx.send(f"Profiling CPU and memory for {seconds}s...")
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            after = tracemalloc.take_snapshot()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        profile_running = False
+
+    summary = format_profile_summary(profiler, before, after)
+    profiler.create_stats()
+    raw_stats = marshal.dumps(profiler.stats)  # Same format as cProfile's dump_stats, readable by pstats
+
+    preview = summary if len(summary) <= 1900 else summary[:1900] + "\n..."
+    await ctx.send(
+        f"Profile finished after {seconds}s.\n```\n{preview}\n```",
+        files=[
+            discord.File(io.BytesIO(summary.encode()), filename="profile-summary.txt"),
+            discord.File(io.BytesIO(raw_stats), filename="profile.prof"),
+        ]
+    )
+
+# BLOCKIMAGE COMMAND
+@bot.command(name="blockimage")
+@bot_admin_only()
+async def blockimage(ctx):
+    if not image_scanner:
+        await ctx.send("Image scanning is turned off.")
+        return
+
+    # Use this message's images, or those of the message it replies to
+    message = ctx.message
+    if not message.attachments and message.reference and message.reference.message_id:
+        message = await ctx.channel.fetch_message(message.reference.message_id)
+
+    attachments = [attachment for attachment in message.attachments if image_scanner.is_scannable(attachment)]
+    if not attachments:
+        await ctx.send("Attach an image or reply to a message with one.")
+        return
+
+    for attachment in attachments:
+        value = await image_scanner.hash_attachment(attachment)
+        image_scanner.block(value)
+        if config.COORDINATOR_ENABLED:
+            # Other workers only read the hash file on startup, so tell them directly
+            await coordinator.send_or_queue({"op": "broadcast", "payload": {"op": "image_block", "hash": value}})
+    await ctx.send(f"Blocked {len(attachments)} image(s). {image_scanner.tree.size} image hash(es) are now blocked.")
+
+# SHARDS COMMAND
+@bot.command(name="shards")
+@admin_only()
+async def shards(ctx):
+    if coordinator.connected:
+        try:
+            workers = await coordinator.request("gather", event="shard_status")
+        except (asyncio.TimeoutError, CoordinatorUnavailable):
+            await ctx.send("The coordinator didn't answer in time.")
+            return
+    else:
+        workers = [local_shard_status()]
+
+    embed = discord.Embed(title="Shard Status", color=discord.Color.blue())
+    for worker in workers:
+        shard_lines = "\n".join(f"Shard {shard['id']}: {shard['latency']} ms" for shard in worker["shards"])
+        embed.add_field(
+            name=f"Process {worker['pid']} ({worker['guilds']} guilds)",
+            value=shard_lines or "No shards",
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+# CONFIG COMMAND
+@bot.group(name="config", invoke_without_command=True)
+@server_admin_only()
+async def config_command(ctx):
+    embed = discord.Embed(
+        title=f"Config for {ctx.guild.name}",
+        description=f"Use `{ctx.prefix}config set <setting> <value>` to change a setting.",
+        color=discord.Color.blue()
+    )
+    for key in GUILD_CONFIG_DEFAULTS:
+        embed.add_field(name=key, value=f"`{guild_config.get(ctx.guild.id, key)}`", inline=False)
     await ctx.send(embed=embed)
 
+@config_command.command(name="set")
+@server_admin_only()
+async def config_set(ctx, key: str, *, value: str):
+    parser = GUILD_CONFIG_PARSERS.get(key)
+    if parser is None:
+        await ctx.send(f"Unknown setting. Available settings: {', '.join(GUILD_CONFIG_PARSERS)}")
+        return
+
+    try:
+        parsed = parser(value)
+    except ValueError:
+        await ctx.send(f"Invalid value for `{key}`.")
+        return
+
+    guild_config.set(ctx.guild.id, key, parsed)
+    await ctx.send(f"`{key}` is now `{parsed}`.")
+
+    # Send to modlog
+    await send_to_modlog(
+        ctx.guild,
+        "Config Updated",
+        f"**Setting:** {key}\n"
+        f"**Value:** {parsed}\n"
+        f"**Moderator:** {ctx.author.mention}",
+        discord.Color.blue()
+    )
+
+@config_command.command(name="reset")
+@server_admin_only()
+async def config_reset(ctx, key: str):
+    if key not in GUILD_CONFIG_DEFAULTS:
+        await ctx.send(f"Unknown setting. Available settings: {', '.join(GUILD_CONFIG_DEFAULTS)}")
+        return
+
+    guild_config.reset(ctx.guild.id, key)
+    await ctx.send(f"`{key}` is back to the default `{guild_config.get(ctx.guild.id, key)}`.")
+
+@config_command.command(name="reload")
+@server_admin_only()
+async def config_reload(ctx):
+    guild_config.load()
+    guild_config.on_change(None)
+    await ctx.send("Guild config reloaded.")
+
 #CLEAN COMMAND
 @bot.command(name="clean")
 @admin_only()
+@limited(guild=1, user=1, cooldown=("user", 1, 60))
 async def clean(ctx, channel_id: int):
     """Deletes all messages in the specified channel"""
     if not ctx.author.guild_permissions.administrator:
@@ -825,6 +3099,7 @@ async def roll(ctx, min_val: int = 1, max_val: int = 100):
 
     # Command: Play music
 @bot.command(name="play", description="Plays a song from YouTube")
+@limited(guild=1, cooldown=("user", 3, 30))
 async def play(ctx, *, search):
     if not ctx.author.voice:
         await ctx.send("You need to be in a voice channel to play music!")
@@ -838,6 +3113,10 @@ async def play(ctx, *, search):
         try:
             song = await get_audio_source(search)
             queue.append(song)
+            if audio_cache:
+                audio_cache.prefetch(song)
+            if loudness_cache:
+                loudness_cache.analyze(song)
 
             if not ctx.voice_client.is_playing():
                 await play_next(ctx)
@@ -854,7 +3133,11 @@ async def play_next(ctx):
         return
 
     song = queue.pop(0)
-    source = discord.FFmpegPCMAudio(song['source'], **FFMPEG_OPTIONS)
+
+    # Play from the local cache when the track has already been downloaded
+    local_path = audio_cache.path_for(song.get('id')) if audio_cache else None
+    ffmpeg_options = loudness_cache.ffmpeg_options(song.get('id')) if loudness_cache else FFMPEG_OPTIONS
+    source = discord.FFmpegPCMAudio(local_path or song['source'], **ffmpeg_options)
     ctx.voice_client.play(source, after=lambda e: bot.loop.create_task(play_next(ctx)))
     await ctx.send(f'Now playing: **{song["title"]}**')
 
@@ -912,87 +3195,125 @@ async def commands_command(ctx, command=None):
         # Help for a specific command
         cmd = bot.get_command(command)
         if cmd:
-            embed = discord.Embed(
-                title=f"Help for `{config.PREFIX}{cmd.name}`",
-                description=cmd.help,
-                color=discord.Color.blue()
-            )
-            
-            # Add aliases if they exist
-            if cmd.aliases:
-                embed.add_field(name="Aliases", value=", ".join(f"`{alias}`" for alias in cmd.aliases), inline=False)
-
-            # Add usage example
-            usage = f"{config.PREFIX}{cmd.name}"
-            if cmd.name in ["warn", "unwarn"]:
-                usage += ' "user_id" "reason"'
-            elif cmd.name == "timeout":
-                usage += ' "user_id" "duration" "reason"'
-            elif cmd.name == "untimeout":
-                usage += ' "user_id"'
-            elif cmd.name == "ban":
-                usage += ' "user_id" [days] "reason"'
-            elif cmd.name in ["kick", "voiceban", "voiceunban", "voicekick"]:
-                usage += ' "user_id" "reason"'
-            elif cmd.name in ["warnings", "userinfo"]:
-                usage += ' "user_id"'
-                
-            embed.add_field(name="Usage", value=f"`{usage}`", inline=False)
-
+            embed = await get_cached_embed(("commands", cmd.name, ctx.prefix), lambda: build_command_help_embed(cmd, ctx.prefix))
             await ctx.send(embed=embed)
         else:
             await ctx.send(f"Command '{command}' not found.")
     else:
         # General help
-        embed = discord.Embed(
-            title="Moderation Bot Commands",
-            description=f"Use `{config.PREFIX}commands <command>` for more details on a specific command.",
-            color=discord.Color.blue()
-        )
-        
-        # General commands
-        embed.add_field(
-            name="General Commands",
-            value=f"`{config.PREFIX}commands` - Show this help message\n"
-                  f"`{config.PREFIX}mywarnings` - View your own warnings\n"
-                  f"`{config.PREFIX}info` - Credit to creator\n",
-            inline=False
-        )
-        #Fun Commands
-        embed.add_field(
-            name="Fun Commands",
-            value=f"`{config.PREFIX}HATE` - i have no mouth and i must scream\n"
-                  f"`{config.PREFIX}GABRIEL` - ULTRAKILL insignificant FUCK!\n"
-                  f"`{config.PREFIX}eightball \"question\"` - its an eightball\n"
-                  f"`{config.PREFIX}roll \"min_num\" \"max_num\"` - rolls a dice\n",
-            inline=False
-        )
+        embed = await get_cached_embed(("commands", ctx.prefix), lambda: build_commands_embed(ctx.prefix))
+        await ctx.send(embed=embed)
 
-        # Moderation commands (admin only)
-        mod_commands = (
-            f"`{config.PREFIX}warn \"user_id\" \"reason\"` - Warn a user\n"
-            f"`{config.PREFIX}unwarn \"user_id\" \"reason\"` - Remove a warning from a user\n"
-            f"`{config.PREFIX}timeout \"user_id\" \"duration\" \"reason\"` - Timeout a user\n"
-            f"`{config.PREFIX}untimeout \"user_id\"` - Remove timeout from a user\n"
-            f"`{config.PREFIX}ban \"user_id\" [days] \"reason\"` - Ban a user\n"
-            f"`{config.PREFIX}unban \"user_id\" \"reason\"` - Unban a user\n"
-            f"`{config.PREFIX}kick \"user_id\" \"reason\"` - Kick a user from the server\n"
-            f"`{config.PREFIX}warnings \"user_id\"` - View warnings for a specific user\n"
-            f"`{config.PREFIX}userinfo \"user_id\"` - Show information about a user\n"
-            f"`{config.PREFIX}voiceban \"user_id\" \"reason\"` - Ban a user from voice channels\n"
-            f"`{config.PREFIX}voiceunban \"user_id\" \"reason\"` - Unban a user from voice channels\n"
-            f"`{config.PREFIX}voicekick \"user_id\" \"reason\"` - Kick a user from a voice channel\n"
-            f"`{config.PREFIX}clean \"channel_id\"` - Deletes all message in a specific channel\n"
-        )
+# Build the help embed for a single command
+async def build_command_help_embed(cmd, prefix):
+    embed = discord.Embed(
+        title=f"Help for `{prefix}{cmd.name}`",
+        description=cmd.help,
+        color=discord.Color.blue()
+    )
 
-        embed.add_field(
-            name="Moderation Commands (Admin Only)",
-            value=mod_commands,
-            inline=False
-        )
-        
-        # Send help message
-        await ctx.send(embed=embed)
+    # Add aliases if they exist
+    if cmd.aliases:
+        embed.add_field(name="Aliases", value=", ".join(f"`{alias}`" for alias in cmd.aliases), inline=False)
+
+    # Add usage example
+    usage = f"{prefix}{cmd.name}"
+    if cmd.name in ["warn", "unwarn"]:
+        usage += ' "user_id" "reason"'
+    elif cmd.name == "timeout":
+        usage += ' "user_id" "duration" "reason"'
+    elif cmd.name == "untimeout":
+        usage += ' "user_id"'
+    elif cmd.name == "ban":
+        usage += ' "user_id" [days] "reason"'
+    elif cmd.name in ["kick", "voiceban", "voiceunban", "voicekick"]:
+        usage += ' "user_id" "reason"'
+    elif cmd.name in ["warnings", "userinfo", "history"]:
+        usage += ' "user_id"'
+    elif cmd.name == "case":
+        usage += ' case_id'
+    elif cmd.name == "reason":
+        usage += ' case_id "reason"'
+
+    embed.add_field(name="Usage", value=f"`{usage}`", inline=False)
+    return embed
+
+# Build the general help embed
+async def build_commands_embed(prefix):
+    embed = discord.Embed(
+        title="Moderation Bot Commands",
+        description=f"Use `{prefix}commands <command>` for more details on a specific command.",
+        color=discord.Color.blue()
+    )
+
+    # General commands
+    embed.add_field(
+        name="General Commands",
+        value="\n".join([
+            f"`{prefix}commands` - Show this help message",
+            f"`{prefix}mywarnings` - View your own warnings",
+            f"`{prefix}info` - Credit to creator",
+        ]),
+        inline=False
+    )
+    #Fun Commands
+    embed.add_field(
+        name="Fun Commands",
+        value="\n".join([
+            f"`{prefix}HATE` - i have no mouth and i must scream",
+            f"`{prefix}GABRIEL` - ULTRAKILL insignificant FUCK!",
+            f"`{prefix}eightball \"question\"` - its an eightball",
+            f"`{prefix}roll \"min_num\" \"max_num\"` - rolls a dice",
+        ]),
+        inline=False
+    )
+
+    # Moderation commands (admin only), split across fields since each field is capped at 1024 characters
+    mod_commands = [
+        f"`{prefix}warn \"user_id\" \"reason\"` - Warn a user",
+        f"`{prefix}unwarn \"user_id\" \"reason\"` - Remove a warning from a user",
+        f"`{prefix}timeout \"user_id\" \"duration\" \"reason\"` - Timeout a user",
+        f"`{prefix}untimeout \"user_id\"` - Remove timeout from a user",
+        f"`{prefix}ban \"user_id\" [days] \"reason\"` - Ban a user",
+        f"`{prefix}unban \"user_id\" \"reason\"` - Unban a user",
+        f"`{prefix}kick \"user_id\" \"reason\"` - Kick a user from the server",
+        f"`{prefix}voiceban \"user_id\" \"reason\"` - Ban a user from voice channels",
+        f"`{prefix}voiceunban \"user_id\" \"reason\"` - Unban a user from voice channels",
+        f"`{prefix}voicekick \"user_id\" \"reason\"` - Kick a user from a voice channel",
+        f"`{prefix}clean \"channel_id\"` - Deletes all message in a specific channel",
+    ]
+    case_commands = [
+        f"`{prefix}warnings \"user_id\"` - View warnings for a specific user",
+        f"`{prefix}userinfo \"user_id\"` - Show information about a user",
+        f"`{prefix}case case_id` - Show a moderation case",
+        f"`{prefix}history \"user_id\"` - Show every moderation case for a user",
+        f"`{prefix}reason case_id \"reason\"` - Change the reason on a moderation case",
+    ]
+    admin_tools = [
+        f"`{prefix}dmstats` - Show DM notification delivery stats",
+        f"`{prefix}shards` - Show shard and worker process status",
+        f"`{prefix}memory` - Show how much memory each cache uses",
+        f"`{prefix}profile [seconds]` - Profile CPU and memory for a while and upload the results",
+        f"`{prefix}blockimage` - Block the attached (or replied-to) images from being posted in every server (bot administrators only)",
+        f"`{prefix}config [set|reset|reload]` - View or change this server's settings (server administrators only)",
+    ]
+
+    embed.add_field(
+        name="Moderation Commands (Admin Only)",
+        value="\n".join(mod_commands),
+        inline=False
+    )
+    embed.add_field(
+        name="Warnings and Cases (Admin Only)",
+        value="\n".join(case_commands),
+        inline=False
+    )
+    embed.add_field(
+        name="Admin Tools (Admin Only)",
+        value="\n".join(admin_tools),
+        inline=False
+    )
+    return embed
 
 # Run the bot
 if __name__ == "__main__":
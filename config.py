@@ -23,4 +23,119 @@ DEFAULT_REASON = "Breaking server rules"
 MAX_WARNINGS = 5
 
 # Auto-timeout duration in seconds (1 day = 86400 seconds)
-AUTO_TIMEOUT_DURATION = 86400
\ No newline at end of file
+AUTO_TIMEOUT_DURATION = 86400
+
+# Number of background workers delivering moderation DMs
+DM_WORKERS = 4
+
+# Maximum number of DMs waiting to be sent before new ones are dropped
+DM_QUEUE_SIZE = 1000
+
+# How long (in seconds) to skip users whose DMs were closed
+DM_CLOSED_TTL = 3600
+
+# Run a single process as an AutoShardedBot (launcher.py sets the options below for each worker)
+AUTO_SHARD = os.getenv("SATURN_AUTO_SHARD", "0") == "1"
+
+# Total shard count and the shards this process runs, set by launcher.py
+SHARD_COUNT = int(os.getenv("SATURN_SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SATURN_SHARD_IDS", "").split(",") if shard_id] or None
+
+# Local coordinator used by launcher.py to link worker processes
+COORDINATOR_ENABLED = os.getenv("SATURN_COORDINATOR", "0") == "1"
+COORDINATOR_HOST = "127.0.0.1"
+COORDINATOR_PORT = int(os.getenv("SATURN_COORDINATOR_PORT", "8765"))
+
+# Number of worker processes started by launcher.py (None = one per CPU core)
+LAUNCHER_PROCESSES = None
+
+# Keep a local copy of played tracks so replays don't stream from the network
+AUDIO_CACHE_ENABLED = False
+
+# Directory for cached tracks and their index file (launcher workers each use their own, suffixed with their shard range)
+AUDIO_CACHE_DIR = "audio_cache"
+
+# Maximum size of the audio cache in bytes (2 GB)
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Number of tracks downloaded at the same time
+AUDIO_CACHE_DOWNLOADS = 2
+
+# Measure each track's loudness once and play it back at a fixed matching gain
+LOUDNESS_NORMALIZATION = False
+
+# Target integrated loudness in LUFS
+LOUDNESS_TARGET = -16.0
+
+# File storing measured gain values by video ID
+LOUDNESS_CACHE_FILE = "loudness.json"
+
+# Number of worker processes measuring loudness
+LOUDNESS_WORKERS = 2
+
+# File storing per-guild settings (prefix, modlog channel, warning limits, moderator roles)
+GUILD_CONFIG_FILE = "guild_config.json"
+
+# How often (in seconds) to check the guild config file for changes
+GUILD_CONFIG_RELOAD_INTERVAL = 30
+
+# Append-only log of moderation cases, one JSON record per line
+CASES_FILE = "cases.jsonl"
+
+# Maximum number of invocations waiting for a busy rate-limited command
+LIMITER_MAX_QUEUE = 10
+
+# Cache profile: "full" keeps every member and recent message, "balanced" and "lean"
+# keep far less and only chunk a guild's members once a moderation command needs them
+CACHE_PROFILE = "full"
+
+# Record gateway events and command invocations for offline replay (see replay.py)
+RECORD_EVENTS = False
+
+# Directory for event recordings (launcher workers each use their own, suffixed with their shard range)
+RECORD_DIR = "recordings"
+
+# Uncompressed bytes written to a recording file before starting a new one (64 MB)
+RECORD_MAX_FILE_BYTES = 64 * 1024 ** 2
+
+# Number of recording files kept before the oldest are deleted
+RECORD_MAX_FILES = 20
+
+# Delete messages linking to blocked domains and warn their authors
+LINK_SCAN_ENABLED = False
+
+# File of blocked domains, one per line (subdomains are blocked too)
+PHISHING_BLOCKLIST_FILE = "phishing_domains.txt"
+
+# Link shortener domains whose links are expanded before checking
+URL_SHORTENERS = [
+    "bit.ly", "tinyurl.com", "t.co", "goo.gl", "is.gd", "ow.ly",
+    "cutt.ly", "rb.gy", "shorturl.at", "tiny.cc", "rebrand.ly",
+]
+
+# How long (in seconds) a link's verdict is cached
+LINK_VERDICT_TTL = 3600
+
+# Maximum number of cached link verdicts
+LINK_VERDICT_CACHE_SIZE = 10000
+
+# Delete messages with images matching known bad images and warn their authors (needs Pillow)
+IMAGE_SCAN_ENABLED = False
+
+# File of blocked image hashes, one 64-bit hex perceptual hash per line
+BAD_IMAGE_HASHES_FILE = "bad_image_hashes.txt"
+
+# Maximum number of differing hash bits for an image to count as a match
+IMAGE_MATCH_DISTANCE = 6
+
+# Attachments larger than this (in bytes) aren't scanned (8 MB)
+IMAGE_SCAN_MAX_BYTES = 8 * 1024 ** 2
+
+# Number of attachments downloaded at the same time
+IMAGE_SCAN_DOWNLOADS = 4
+
+# Number of worker processes hashing images
+IMAGE_SCAN_WORKERS = 2
+
+# Number of perceptual hashes cached by attachment content
+IMAGE_HASH_CACHE_SIZE = 5000
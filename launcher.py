@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import sys
+import requests
+import config
+
+# Launches bot.py as several worker processes, each running a range of shards,
+# and runs the coordinator that links them together.
+#
+# Usage: python launcher.py [processes]
+
+# Seconds Discord wants between shard identifies in the same concurrency bucket
+IDENTIFY_DELAY = 5
+
+# Seconds to wait before restarting a worker that exited
+RESTART_DELAY = 5
+
+# Ask Discord how many shards it recommends for this bot
+def fetch_gateway_info():
+    response = requests.get(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {config.TOKEN}"},
+        timeout=10
+    )
+    response.raise_for_status()
+    data = response.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+# Split shard ids into contiguous ranges, one per process
+def split_shards(shard_count, processes):
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+# Routes messages between workers and owns the shared warnings and case files
+class Coordinator:
+    def __init__(self):
+        self.workers = {}  # writer -> hello message
+        self.pending = {}
+        self.next_id = 0
+        self.warnings_db = {}
+        if os.path.exists('warnings.json'):
+            with open('warnings.json', 'r') as f:
+                self.warnings_db = json.load(f)
+        self.last_case_id = 0
+        if os.path.exists(config.CASES_FILE):
+            with open(config.CASES_FILE, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if record["type"] == "case":
+                            self.last_case_id = max(self.last_case_id, record["id"])
+
+    async def send(self, writer, payload):
+        writer.write(json.dumps(payload).encode() + b"\n")
+        await writer.drain()
+
+    async def broadcast(self, payload, exclude=None):
+        for writer in list(self.workers):
+            if writer is exclude:
+                continue
+            try:
+                await self.send(writer, payload)
+            except ConnectionError:
+                self.workers.pop(writer, None)
+
+    # Ask every worker for something and collect their replies
+    async def gather(self, event, timeout=5):
+        futures = []
+        for writer in list(self.workers):
+            self.next_id += 1
+            future = asyncio.get_running_loop().create_future()
+            self.pending[self.next_id] = future
+            futures.append(future)
+            try:
+                await self.send(writer, {"op": event, "id": self.next_id})
+            except ConnectionError:
+                future.set_result(None)
+        done, _ = await asyncio.wait(futures, timeout=timeout) if futures else (set(), set())
+        return [future.result() for future in done if future.result() is not None]
+
+    async def reply_gather(self, writer, message):
+        result = await self.gather(message["event"])
+        try:
+            await self.send(writer, {"reply_to": message["id"], "result": result})
+        except ConnectionError:
+            pass
+
+    # Apply a warning change, save it and push the result to every worker
+    async def apply_warnings(self, message):
+        user_id = message["user_id"]
+        warning_list = self.warnings_db.setdefault(user_id, [])
+        if message["action"] == "add":
+            warning_list.append(message["warning"])
+        elif message["action"] == "remove" and warning_list:
+            warning_list.pop()
+        # Replace the file in one step, since workers re-read it after reconnecting
+        with open('warnings.json.tmp', 'w') as f:
+            json.dump(self.warnings_db, f)
+        os.replace('warnings.json.tmp', 'warnings.json')
+        await self.broadcast({"op": "warnings_sync", "user_id": user_id, "warnings": warning_list})
+
+    # Number a case log record, append it and push it to every worker
+    async def append_case(self, writer, message):
+        record = message["record"]
+        if record["type"] == "case":
+            self.last_case_id += 1
+            record["id"] = self.last_case_id
+        with open(config.CASES_FILE, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+        await self.broadcast({"op": "case_sync", "record": record})
+        try:
+            await self.send(writer, {"reply_to": message["id"], "result": record["id"]})
+        except ConnectionError:
+            pass
+
+    async def handle_worker(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get("op")
+
+                if "reply_to" in message:
+                    future = self.pending.pop(message["reply_to"], None)
+                    if future and not future.done():
+                        future.set_result(message.get("result"))
+                elif op == "hello":
+                    self.workers[writer] = message
+                    print(f"Worker {message['pid']} connected with shards {message['shard_ids']}")
+                elif op == "broadcast":
+                    await self.broadcast(message["payload"], exclude=writer)
+                elif op == "warnings":
+                    await self.apply_warnings(message)
+                elif op == "case":
+                    await self.append_case(writer, message)
+                elif op == "gather":
+                    # The requester answers too, so don't block its reader while gathering
+                    asyncio.create_task(self.reply_gather(writer, message))
+        except ConnectionError:
+            pass
+        finally:
+            hello = self.workers.pop(writer, None)
+            if hello:
+                print(f"Worker {hello['pid']} disconnected")
+            writer.close()
+
+# Run one worker process, restarting it if it exits
+async def run_worker(shard_ids, shard_count, start_delay):
+    await asyncio.sleep(start_delay)
+    env = dict(
+        os.environ,
+        SATURN_SHARD_IDS=",".join(str(shard_id) for shard_id in shard_ids),
+        SATURN_SHARD_COUNT=str(shard_count),
+        SATURN_COORDINATOR="1",
+        SATURN_COORDINATOR_PORT=str(config.COORDINATOR_PORT)
+    )
+    while True:
+        process = await asyncio.create_subprocess_exec(sys.executable, "bot.py", env=env)
+        code = await process.wait()
+        print(f"Worker for shards {shard_ids} exited with code {code}, restarting in {RESTART_DELAY}s")
+        await asyncio.sleep(RESTART_DELAY)
+
+async def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else (config.LAUNCHER_PROCESSES or os.cpu_count() or 1)
+    shard_count, max_concurrency = fetch_gateway_info()
+    if config.SHARD_COUNT:
+        shard_count = config.SHARD_COUNT
+    shard_ranges = split_shards(shard_count, processes)
+    print(f"Starting {len(shard_ranges)} worker(s) for {shard_count} shard(s)")
+
+    coordinator = Coordinator()
+    server = await asyncio.start_server(coordinator.handle_worker, config.COORDINATOR_HOST, config.COORDINATOR_PORT)
+
+    # Stagger worker start-up so their shard identifies don't collide
+    workers = []
+    start_delay = 0
+    for shard_ids in shard_ranges:
+        workers.append(run_worker(shard_ids, shard_count, start_delay))
+        start_delay += len(shard_ids) * IDENTIFY_DELAY / max_concurrency
+
+    async with server:
+        await asyncio.gather(*workers)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
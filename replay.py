@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import cProfile
+import glob
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+import discord
+import config
+
+# bot.py is imported by isolate() once its settings point somewhere safe
+saturn = None
+
+# Replays an event recording (see RECORD_EVENTS in config.py) through the bot's
+# handlers without connecting to Discord. REST calls are answered by a stub.
+#
+# Usage: python replay.py recordings/ [--speed 10] [--rest-latency 0.05] [--profile replay.prof]
+#
+# This drives discord.py's internal gateway parsers directly, the same way its
+# websocket does, so it is tied to the discord.py version pinned in requirements.txt.
+#
+# The replay runs in a scratch directory seeded with copies of the bot's data files,
+# so replayed commands never change the real warnings, cases or guild settings.
+
+# Data files copied into the scratch directory so replayed commands see realistic state
+DATA_FILES = ["warnings.json", config.CASES_FILE, config.GUILD_CONFIG_FILE]
+
+rest_calls = Counter()
+dispatched = Counter()
+next_snowflake = int(time.time() * 1000 - 1420070400000) << 22
+
+def snowflake():
+    global next_snowflake
+    next_snowflake += 1
+    return str(next_snowflake)
+
+def fake_user(user_id):
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None}
+
+def iso_now():
+    return discord.utils.utcnow().isoformat()
+
+# Build a plausible response for a REST route so handlers keep running
+def fake_response(route, kwargs):
+    url = route.url
+    payload = kwargs.get("json") or {}
+
+    if route.method == "POST" and re.search(r"/channels/\d+/messages$", url):
+        return {
+            "id": snowflake(),
+            "channel_id": str(route.channel_id),
+            "author": saturn.bot.user._to_minimal_user_json() if saturn.bot.user else fake_user(0),
+            "content": payload.get("content") or "",
+            "timestamp": iso_now(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": payload.get("embeds") or [],
+            "pinned": False,
+            "type": 0,
+        }
+    if route.method == "POST" and url.endswith("/users/@me/channels"):
+        return {"id": snowflake(), "type": 1, "recipients": [fake_user(payload.get("recipient_id", 0))]}
+
+    match = re.search(r"/guilds/\d+/members/(\d+)$", url)
+    if route.method == "GET" and match:
+        return {"user": fake_user(match.group(1)), "roles": [], "joined_at": iso_now(), "deaf": False, "mute": False}
+    match = re.search(r"/users/(\d+)$", url)
+    if route.method == "GET" and match:
+        return fake_user(match.group(1))
+    if route.method == "GET" and re.search(r"/guilds/\d+/bans$", url):
+        return []
+    return {}
+
+# Stand-in for HTTPClient.request that counts calls and simulates latency
+def make_stub_request(latency):
+    async def request(route, **kwargs):
+        rest_calls[f"{route.method} {route.path}"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        return fake_response(route, kwargs)
+    return request
+
+# Stand-in for yt-dlp lookups, so replayed ?play commands don't reach the network
+async def fake_audio_source(url):
+    rest_calls["yt-dlp extract_info"] += 1
+    return {"source": "anullsrc", "title": url, "id": None, "webpage_url": url}
+
+# Import bot.py inside a scratch directory with everything that writes shared state
+# or makes its own network requests turned off
+def isolate():
+    global saturn
+    workdir = tempfile.mkdtemp(prefix="saturn-replay-")
+    for name in DATA_FILES:
+        if os.path.exists(name):
+            shutil.copy(name, workdir)
+    os.chdir(workdir)
+
+    config.COORDINATOR_ENABLED = False
+    config.RECORD_EVENTS = False
+    config.AUDIO_CACHE_ENABLED = False
+    config.LOUDNESS_NORMALIZATION = False
+    config.LINK_SCAN_ENABLED = False
+    config.IMAGE_SCAN_ENABLED = False
+    config.RECORD_DIR = os.path.join(workdir, "recordings")
+    config.AUDIO_CACHE_DIR = os.path.join(workdir, "audio_cache")
+
+    import bot
+    saturn = bot
+    saturn.get_audio_source = fake_audio_source
+    return workdir
+
+# Stand-in for the gateway websocket, accepting and ignoring anything sent to it
+class StubWebSocket:
+    def __getattr__(self, name):
+        async def ignore(*args, **kwargs):
+            return None
+        return ignore
+
+async def replay(paths, speed, rest_latency, drain):
+    bot = saturn.bot
+
+    # Bind the bot to this loop the way bot.start() would, then swap out network access
+    await bot._async_setup_hook()
+    bot.http.request = make_stub_request(rest_latency)
+    bot.ws = StubWebSocket()
+    bot._connection._chunk_guilds = False
+    await bot.setup_hook()
+
+    parsers = bot._connection.parsers
+    first_timestamp = None
+    started = time.monotonic()
+    commands_seen = 0
+
+    for kind, timestamp, payload in saturn.read_recording(paths):
+        # Keep the recorded spacing between events, sped up by the given factor
+        if speed > 0:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = (timestamp - first_timestamp) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if kind == saturn.RECORD_COMMAND:
+            commands_seen += 1
+            continue
+
+        message = json.loads(payload)
+        if message.get("op") != 0:
+            continue  # Only dispatch events reach handlers
+        parser = parsers.get(message["t"])
+        if parser is None:
+            continue
+        try:
+            parser(message["d"])
+            dispatched[message["t"]] += 1
+        except Exception as e:
+            print(f"Failed to replay {message['t']}: {e}")
+        await asyncio.sleep(0)  # Let handlers started by this event run
+
+    # Give handlers still in flight time to finish
+    await asyncio.sleep(drain)
+    elapsed = time.monotonic() - started
+
+    print(f"Replayed {sum(dispatched.values())} events and {commands_seen} recorded commands in {elapsed:.2f}s")
+    print("\nEvents:")
+    for name, count in dispatched.most_common():
+        print(f"  {count:8d}  {name}")
+    print("\nREST calls:")
+    for name, count in rest_calls.most_common():
+        print(f"  {count:8d}  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a gateway event recording through the bot.")
+    parser.add_argument("recording", help="A recording file or a directory of them")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed factor, 0 for as fast as possible")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="Seconds each stubbed REST call takes")
+    parser.add_argument("--drain", type=float, default=5.0, help="Seconds to wait for handlers after the last event")
+    parser.add_argument("--profile", help="Write cProfile stats for the replay to this file")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.recording):
+        paths = glob.glob(os.path.join(os.path.abspath(args.recording), "*.bin.gz"))
+    else:
+        paths = [os.path.abspath(args.recording)]
+    profile_path = os.path.abspath(args.profile) if args.profile else None
+
+    workdir = isolate()
+    print(f"Replaying in {workdir}")
+
+    run = replay(paths, args.speed, args.rest_latency, args.drain)
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        asyncio.run(run)
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        print(f"\nProfile written to {profile_path}")
+    else:
+        asyncio.run(run)
+
+if __name__ == "__main__":
+    main()